@@ -0,0 +1,72 @@
+import hashlib
+import time
+
+from api.metrics import record_cache
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from recipes.models import Tag
+from rest_framework.renderers import JSONRenderer
+
+CATALOG_KEY_PREFIX = 'catalog:'
+TAG_IDS_KEY = CATALOG_KEY_PREFIX + 'tag_ids'
+
+
+def invalidate_catalog(name):
+    cache.delete(CATALOG_KEY_PREFIX + name)
+
+
+def get_catalog(name, build):
+    key = CATALOG_KEY_PREFIX + name
+    entry = cache.get(key)
+    record_cache(name, entry is not None)
+    if entry is None:
+        content = JSONRenderer().render(build())
+        entry = {
+            'content': content,
+            'etag': '"{}"'.format(hashlib.md5(content).hexdigest()),
+            'last_modified': int(time.time()),
+        }
+        cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+    return entry
+
+
+def invalidate_tag_ids():
+    cache.delete(TAG_IDS_KEY)
+
+
+def get_tag_ids():
+    """Возвращает словарь slug -> id всех тегов."""
+    tag_ids = cache.get(TAG_IDS_KEY)
+    record_cache('tag_ids', tag_ids is not None)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(TAG_IDS_KEY, tag_ids, settings.CATALOG_CACHE_TIMEOUT)
+    return tag_ids
+
+
+class CachedCatalogMixin:
+    """Отдает полный список объектов из кеша с поддержкой ETag."""
+    catalog_name = None
+
+    def list(self, request, *args, **kwargs):
+        if request.query_params:
+            return super().list(request, *args, **kwargs)
+        entry = get_catalog(self.catalog_name, self.build_catalog)
+        response = get_conditional_response(
+            request,
+            etag=entry['etag'],
+            last_modified=entry['last_modified'],
+        )
+        if response is None:
+            response = HttpResponse(entry['content'],
+                                    content_type='application/json')
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        return response
+
+    def build_catalog(self):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self.get_serializer(queryset, many=True).data
@@ -0,0 +1,94 @@
+import heapq
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db.models import OuterRef, Subquery
+from recipes.models import Recipe
+
+User = get_user_model()
+
+FEED_KEY_PREFIX = 'feed:recipes:'
+
+
+def invalidate_author_feed(author_id):
+    cache.delete(f'{FEED_KEY_PREFIX}{author_id}')
+
+
+def author_signatures(author_ids):
+    """Число рецептов и id последнего рецепта каждого автора.
+
+    Один запрос по первичному ключу авторов и индексу (author, -id). По этим
+    значениям закешированные списки сверяются с базой: локальный кеш
+    другого процесса не узнает об удалении ключа, а подпись изменится.
+    """
+    last_recipe = Recipe.objects.filter(
+        author=OuterRef('pk')).order_by('-id').values('id')[:1]
+    rows = User.objects.filter(id__in=author_ids).annotate(
+        last_recipe_id=Subquery(last_recipe)
+    ).values_list('id', 'recipes_count', 'last_recipe_id')
+    return {author_id: (count, last_recipe_id)
+            for author_id, count, last_recipe_id in rows}
+
+
+def get_author_recipe_ids(author_ids):
+    """Возвращает отсортированные по возрастанию id рецептов каждого автора.
+    """
+    keys = {f'{FEED_KEY_PREFIX}{author_id}': author_id
+            for author_id in author_ids}
+    signatures = author_signatures(author_ids)
+    lists = {}
+    for key, entry in cache.get_many(keys).items():
+        author_id = keys[key]
+        if entry['signature'] == signatures.get(author_id):
+            lists[author_id] = entry['recipe_ids']
+    missing = [author_id for author_id in author_ids
+               if author_id not in lists]
+    if missing:
+        loaded = {author_id: [] for author_id in missing}
+        rows = Recipe.objects.filter(author_id__in=missing).order_by(
+            'author_id', 'id').values_list('author_id', 'id')
+        for author_id, recipe_id in rows.iterator():
+            loaded[author_id].append(recipe_id)
+        cache.set_many({
+            f'{FEED_KEY_PREFIX}{author_id}': {
+                'signature': signatures.get(author_id),
+                'recipe_ids': recipe_ids,
+            }
+            for author_id, recipe_ids in loaded.items()
+        }, settings.FEED_CACHE_TIMEOUT)
+        lists.update(loaded)
+    return list(lists.values())
+
+
+def iterate_before(recipe_ids, position):
+    start = (len(recipe_ids) if position is None
+             else bisect_left(recipe_ids, position))
+    return (recipe_ids[index] for index in range(start - 1, -1, -1))
+
+
+def iterate_after(recipe_ids, position):
+    start = bisect_right(recipe_ids, position)
+    return (recipe_ids[index] for index in range(start, len(recipe_ids)))
+
+
+def merge_feed_ids(author_ids, cursor, size):
+    """k-way слияние списков авторов вокруг позиции курсора.
+
+    Возвращает id рецептов, которые попадут на страницу ленты, не читая
+    рецепты авторов дальше нужной позиции.
+    """
+    lists = get_author_recipe_ids(author_ids)
+    position = cursor.position if cursor else None
+    if position is not None:
+        position = int(position)
+    if cursor and cursor.reverse and position is not None:
+        merged = heapq.merge(*(iterate_after(recipe_ids, position)
+                               for recipe_ids in lists))
+    else:
+        merged = heapq.merge(*(iterate_before(recipe_ids, position)
+                               for recipe_ids in lists), reverse=True)
+    offset = cursor.offset if cursor else 0
+    return list(islice(merged, offset + size + 1))
@@ -1,39 +1,69 @@
+from api.cache import get_tag_ids
+from api.search import search_ingredients, search_recipes
 from django.contrib.auth import get_user_model
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import Ingredient, Recipe
 
 User = get_user_model()
 
+RECIPE_ORDERINGS = {
+    'newest': ('-id',),
+    'popular': ('-popular_score', '-id'),
+    'trending': ('-trending_score', '-id'),
+    'quickest': ('cooking_time', '-id'),
+}
+
 
 class IngredientFilter(FilterSet):
-    name = filters.CharFilter(lookup_expr='startswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, queryset, field_name, value):
+        return search_ingredients(queryset, value)
+
 
 class RecipeFilter(FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all(),
+    tags = filters.MultipleChoiceFilter(
+        choices=lambda: [(slug, slug) for slug in get_tag_ids()],
+        method='filter_tags',
     )
     is_in_shopping_cart = filters.BooleanFilter(method='filter_shopping_cart')
     is_favorited = filters.BooleanFilter(method='filter_favorites')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author')
 
+    def filter_tags(self, queryset, field_name, value):
+        tag_ids = get_tag_ids()
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tag_ids[slug] for slug in value if slug in tag_ids],
+        )))
+
     def filter_shopping_cart(self, queryset, field_name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(cart__user=user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
     def filter_favorites(self, queryset, field_name, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorites__user=user)
+            return queryset.filter(is_favorited=True)
         return queryset
+
+    def filter_search(self, queryset, field_name, value):
+        return search_recipes(queryset, value.strip())
+
+    def filter_ordering(self, queryset, field_name, value):
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
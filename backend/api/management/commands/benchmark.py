@@ -0,0 +1,293 @@
+import json
+import random
+import time
+from datetime import timedelta
+
+from api.matching import recipe_index
+from api.search import refresh_recipe_search
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from recipes.models import (Favorite, Ingredient, IngredientRecipe, Recipe,
+                            ShoppingCart, Tag)
+from rest_framework.test import APIClient
+from users.models import Subscribe
+
+User = get_user_model()
+
+BENCH_PREFIX = 'bench_'
+
+QUERY_BUDGETS = {
+    'users-list': 2,
+    'users-detail': 1,
+    'users-me': 2,
+    'users-subscriptions': 4,
+    'users-subscribe': 8,
+    'tags-list': 1,
+    'tags-detail': 1,
+    'ingredients-list': 1,
+    'ingredients-search': 1,
+    'ingredients-detail': 1,
+    'recipes-list': 5,
+    'recipes-list-cursor': 4,
+    'recipes-list-tags': 5,
+    'recipes-list-author': 5,
+    'recipes-list-favorited': 5,
+    'recipes-list-in-cart': 5,
+    'recipes-list-all-filters': 5,
+    'recipes-list-popular': 5,
+    'recipes-list-trending': 5,
+    'recipes-list-quickest': 5,
+    'recipes-search': 5,
+    'recipes-what-to-cook': 3,
+    'recipes-feed': 4,
+    'recipes-similar': 2,
+    'recipes-recommended': 4,
+    'recipes-detail': 4,
+    'recipes-favorite': 6,
+    'recipes-shopping-cart': 6,
+    'recipes-download-shopping-cart': 2,
+}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def response_size(response):
+    if getattr(response, 'streaming', False):
+        return sum(len(chunk) for chunk in response.streaming_content)
+    return len(response.content)
+
+
+class Command(BaseCommand):
+    help = ('Замер количества запросов, времени ответа и размера ответа '
+            'для всех маршрутов API на синтетических данных')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', action='store_true',
+                            help='Наполнить базу синтетическими данными')
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--recipes', type=int, default=20000)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--limit', type=int, default=6,
+                            help='Размер страницы для списков')
+        parser.add_argument('--budgets',
+                            help='JSON-файл с лимитами запросов по маршрутам')
+        parser.add_argument('--output', help='Файл для JSON-отчета')
+        parser.add_argument('--force', action='store_true',
+                            help='Разрешить --seed для базы не на SQLite')
+
+    def handle(self, *args, **options):
+        random.seed(0)
+        if options['seed']:
+            if connection.vendor != 'sqlite' and not options['force']:
+                raise CommandError(
+                    'Синтетические данные загружаются только в SQLite, '
+                    'для другой базы (например, PostgreSQL из DATABASES '
+                    'по умолчанию) добавьте --force')
+            self.seed(options['users'], options['recipes'])
+        user = User.objects.filter(
+            username__startswith=BENCH_PREFIX).order_by('id').first()
+        if user is None:
+            raise CommandError('Нет синтетических данных, запустите с --seed')
+        budgets = dict(QUERY_BUDGETS)
+        if options['budgets']:
+            with open(options['budgets'], encoding='utf-8') as file:
+                budgets.update(json.load(file))
+
+        client = APIClient()
+        client.force_authenticate(user)
+        report = [
+            self.measure(client, name, method, url, options['repeat'])
+            for name, method, url in self.get_cases(user, options['limit'])
+        ]
+        # Списки замеряются еще и на вдвое большей странице: если число
+        # запросов растет вместе с ней, в маршруте запрос на каждую строку.
+        larger = self.get_cases(user, options['limit'] * 2)
+        failures = []
+        for row, (_, method, url) in zip(report, larger):
+            budget = budgets.get(row['name'])
+            row['budget'] = budget
+            row['over_budget'] = budget is not None and row['queries'] > budget
+            row['grows_with_page'] = url != row['url'] and self.measure(
+                client, row['name'], method, url, 2)['queries'] > row[
+                    'queries']
+            if row['over_budget'] or row['grows_with_page']:
+                failures.append(row['name'])
+            self.stdout.write(
+                f"{row['name']:32} {row['status']} q={row['queries']:<3} "
+                f"p50={row['p50_ms']:.1f}ms p95={row['p95_ms']:.1f}ms "
+                f"size={row['size']}")
+
+        result = json.dumps({'routes': report, 'failures': failures},
+                            ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(result)
+        else:
+            self.stdout.write(result)
+        if failures:
+            raise CommandError(
+                'Превышен лимит запросов или их число растет с размером '
+                'страницы: ' + ', '.join(failures))
+
+    def get_cases(self, user, limit):
+        author = Subscribe.objects.filter(user=user).values_list(
+            'author_id', flat=True).first() or user.id
+        recipe = Recipe.objects.values_list('id', flat=True).first()
+        ingredient = Ingredient.objects.values_list('id', flat=True).first()
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        tag_query = '&'.join(f'tags={slug}' for slug in tags)
+        tag = Tag.objects.values_list('id', flat=True).first()
+        recipes = f'/api/recipes/?limit={limit}'
+        ingredients = ','.join(str(pk) for pk in IngredientRecipe.objects
+                               .filter(recipe_id=recipe)
+                               .values_list('ingredient_id', flat=True))
+        return [
+            ('users-list', 'get', f'/api/users/?limit={limit}'),
+            ('users-detail', 'get', f'/api/users/{author}/'),
+            ('users-me', 'get', '/api/users/me/'),
+            ('users-subscriptions', 'get',
+             f'/api/users/subscriptions/?limit={limit}&recipes_limit=3'),
+            ('users-subscribe', 'toggle', f'/api/users/{author}/subscribe/'),
+            ('tags-list', 'get', '/api/tags/'),
+            ('tags-detail', 'get', f'/api/tags/{tag}/'),
+            ('ingredients-list', 'get', '/api/ingredients/'),
+            ('ingredients-search', 'get', '/api/ingredients/?name=сах'),
+            ('ingredients-detail', 'get', f'/api/ingredients/{ingredient}/'),
+            ('recipes-list', 'get', recipes),
+            ('recipes-list-cursor', 'get', f'{recipes}&pagination=cursor'),
+            ('recipes-list-tags', 'get', f'{recipes}&{tag_query}'),
+            ('recipes-list-author', 'get', f'{recipes}&author={author}'),
+            ('recipes-list-favorited', 'get', f'{recipes}&is_favorited=1'),
+            ('recipes-list-in-cart', 'get',
+             f'{recipes}&is_in_shopping_cart=1'),
+            ('recipes-list-all-filters', 'get',
+             f'{recipes}&{tag_query}&author={author}'
+             '&is_favorited=1&is_in_shopping_cart=1'),
+            ('recipes-list-popular', 'get', f'{recipes}&ordering=popular'),
+            ('recipes-list-trending', 'get',
+             f'{recipes}&ordering=trending'),
+            ('recipes-list-quickest', 'get',
+             f'{recipes}&ordering=quickest'),
+            ('recipes-search', 'get', f'{recipes}&search=сахар'),
+            ('recipes-feed', 'get', f'/api/recipes/feed/?limit={limit}'),
+            ('recipes-similar', 'get', f'/api/recipes/{recipe}/similar/'),
+            ('recipes-recommended', 'get',
+             f'/api/recipes/recommended/?limit={limit}'),
+            ('recipes-what-to-cook', 'get',
+             f'/api/recipes/what_to_cook/?limit={limit}'
+             f'&ingredients={ingredients}'),
+            ('recipes-detail', 'get', f'/api/recipes/{recipe}/'),
+            ('recipes-favorite', 'toggle', f'/api/recipes/{recipe}/favorite/'),
+            ('recipes-shopping-cart', 'toggle',
+             f'/api/recipes/{recipe}/shopping_cart/'),
+            ('recipes-download-shopping-cart', 'get',
+             '/api/recipes/download_shopping_cart/'),
+        ]
+
+    def request(self, client, method, url):
+        if method != 'toggle':
+            return [client.get(url)]
+        first = client.post(url)
+        second = client.delete(url)
+        if first.status_code >= 400:
+            return [second, client.post(url)]
+        return [first, second]
+
+    def measure(self, client, name, method, url, repeat):
+        timings = []
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                responses = self.request(client, method, url)
+                sizes = [response_size(response) for response in responses]
+                timings.append((time.perf_counter() - started) * 1000)
+        return {
+            'name': name,
+            'method': method.upper(),
+            'url': url,
+            'status': responses[0].status_code,
+            'queries': len(queries) // len(responses),
+            'p50_ms': round(percentile(timings, 0.5), 2),
+            'p95_ms': round(percentile(timings, 0.95), 2),
+            'p99_ms': round(percentile(timings, 0.99), 2),
+            'size': max(sizes),
+        }
+
+    def seed(self, users_count, recipes_count):
+        if User.objects.filter(username__startswith=BENCH_PREFIX).exists():
+            self.stdout.write('Синтетические данные уже загружены')
+            return
+        if not Ingredient.objects.exists():
+            call_command('import')
+        for index in range(max(0, 8 - Tag.objects.count())):
+            Tag.objects.get_or_create(
+                slug=f'{BENCH_PREFIX}{index}',
+                defaults={'name': f'{BENCH_PREFIX}{index}',
+                          'color': f'#bench{index}'})
+        password = make_password(None)
+        User.objects.bulk_create(
+            User(email=f'{BENCH_PREFIX}{index}@example.com',
+                 username=f'{BENCH_PREFIX}{index}',
+                 first_name='Bench', last_name=str(index), password=password)
+            for index in range(users_count)
+        )
+        user_ids = list(User.objects.filter(
+            username__startswith=BENCH_PREFIX).values_list('id', flat=True))
+        Recipe.objects.bulk_create((
+            Recipe(author_id=random.choice(user_ids),
+                   name=f'{BENCH_PREFIX}{index}',
+                   image='recipe_images/bench.png',
+                   text='Синтетический рецепт ' * 10,
+                   cooking_time=random.randint(1, 180))
+            for index in range(recipes_count)
+        ), batch_size=1000)
+        recipe_ids = list(Recipe.objects.filter(
+            name__startswith=BENCH_PREFIX).values_list('id', flat=True))
+        self.seed_relations(user_ids, recipe_ids)
+        for start in range(0, len(recipe_ids), 1000):
+            refresh_recipe_search(recipe_ids[start:start + 1000])
+        recipe_index.invalidate()
+        call_command('recount')
+        call_command('rebuild_cart')
+        call_command('build_recommendations')
+        call_command('rebuild_ranking')
+        self.stdout.write(
+            f'Создано {users_count} пользователей и {recipes_count} рецептов')
+
+    def seed_relations(self, user_ids, recipe_ids):
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        IngredientRecipe.objects.bulk_create((
+            IngredientRecipe(recipe_id=recipe_id, ingredient_id=ingredient_id,
+                             amount=random.randint(1, 500))
+            for recipe_id in recipe_ids
+            for ingredient_id in random.sample(ingredient_ids, 8)
+        ), batch_size=5000)
+        Recipe.tags.through.objects.bulk_create((
+            Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+            for recipe_id in recipe_ids
+            for tag_id in random.sample(tag_ids, 2)
+        ), batch_size=5000)
+        now = timezone.now()
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create((
+                model(user_id=user_id, recipe_id=recipe_id,
+                      created_at=now - timedelta(
+                          seconds=random.randint(0, 30 * 24 * 3600)))
+                for user_id in user_ids
+                for recipe_id in random.sample(recipe_ids, 10)
+            ), batch_size=5000)
+        Subscribe.objects.bulk_create((
+            Subscribe(user_id=user_id, author_id=author_id)
+            for user_id in user_ids
+            for author_id in random.sample(user_ids, 20)
+            if author_id != user_id
+        ), batch_size=5000)
@@ -0,0 +1,113 @@
+import re
+
+from api.filters import RecipeFilter
+from api.utils import ingredients_in_cart
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from django.test import RequestFactory
+from recipes.models import Favorite, Recipe, ShoppingCart, Tag
+from users.models import Subscribe
+
+User = get_user_model()
+
+PAGE_SIZE = 6
+SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)(?!.*INDEX)'),
+}
+# Лента рецептов читается по первичному ключу в порядке -id и
+# останавливается после LIMIT строк, поэтому обход таблицы здесь ожидаем.
+FEED_SCAN = {'recipes_recipe'}
+
+
+class Command(BaseCommand):
+    help = ('EXPLAIN для основных запросов API с поиском '
+            'последовательных сканирований таблиц')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--analyze', action='store_true',
+                            help='EXPLAIN ANALYZE (только PostgreSQL)')
+
+    def handle(self, *args, **options):
+        pattern = SEQ_SCAN_PATTERNS.get(connection.vendor)
+        if pattern is None:
+            raise CommandError(
+                f'EXPLAIN для {connection.vendor} не поддерживается')
+        user = Subscribe.objects.values_list('user', flat=True).first()
+        recipe = Recipe.objects.order_by('id').first()
+        if user is None or recipe is None:
+            raise CommandError('Нет данных, запустите benchmark --seed')
+        user = User.objects.get(pk=user)
+        explain_options = {}
+        if options['analyze'] and connection.vendor == 'postgresql':
+            explain_options = {'analyze': True, 'buffers': True}
+
+        failures = []
+        for name, queryset, allowed in self.get_cases(user, recipe):
+            plan = queryset.explain(**explain_options)
+            scans = set(pattern.findall(plan)) - allowed
+            status = 'SEQ SCAN ' + ', '.join(sorted(scans)) if scans else 'ok'
+            self.stdout.write(f'{name:28} {status}')
+            if options['verbosity'] > 1:
+                self.stdout.write(plan + '\n')
+            if scans:
+                failures.append(name)
+        if failures:
+            raise CommandError(
+                'Последовательное сканирование: ' + ', '.join(failures))
+
+    def filter_recipes(self, user, **params):
+        request = RequestFactory().get('/api/recipes/', params)
+        request.user = user
+        queryset = Recipe.objects.select_related('author').with_user_flags(
+            user)
+        return RecipeFilter(request.GET, queryset=queryset,
+                            request=request).qs[:PAGE_SIZE]
+
+    def get_cases(self, user, recipe):
+        tags = list(Tag.objects.values_list('slug', flat=True)[:2])
+        author = recipe.author_id
+        return [
+            ('recipes-list', self.filter_recipes(user), FEED_SCAN),
+            ('recipes-list-author',
+             self.filter_recipes(user, author=author), set()),
+            ('recipes-list-tags',
+             self.filter_recipes(user, tags=tags), FEED_SCAN),
+            ('recipes-list-popular',
+             self.filter_recipes(user, ordering='popular'), set()),
+            ('recipes-list-trending',
+             self.filter_recipes(user, ordering='trending'), set()),
+            ('recipes-list-quickest',
+             self.filter_recipes(user, ordering='quickest'), set()),
+            ('recipes-list-favorited',
+             self.filter_recipes(user, is_favorited=1), FEED_SCAN),
+            ('recipes-list-in-cart',
+             self.filter_recipes(user, is_in_shopping_cart=1), FEED_SCAN),
+            ('recipes-feed',
+             Recipe.objects.filter(author__in=Subscribe.objects.filter(
+                 user=user).values('author')).order_by('-id')[:PAGE_SIZE],
+             set()),
+            ('recipe-similar',
+             Recipe.objects.filter(similar_for__recipe=recipe)
+             .order_by('-similar_for__score')[:PAGE_SIZE], set()),
+            ('user-recommended',
+             Recipe.objects.filter(recommended_for__user=user)
+             .order_by('-recommended_for__score', '-id')[:PAGE_SIZE],
+             set()),
+            ('recipe-favorited-by',
+             Favorite.objects.filter(recipe=recipe).values('user'), set()),
+            ('recipe-in-carts',
+             ShoppingCart.objects.filter(recipe=recipe).values('user'),
+             set()),
+            ('recipe-counters',
+             Favorite.objects.filter(recipe=recipe).values('recipe')
+             .annotate(total=Count('pk')), set()),
+            ('cart-ingredients', ingredients_in_cart(user), set()),
+            ('subscriptions',
+             User.objects.filter(subscribing__user=user)
+             .order_by('id')[:PAGE_SIZE], set()),
+            ('author-subscribers',
+             Subscribe.objects.filter(author=author).values('user'), set()),
+        ]
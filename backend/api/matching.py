@@ -0,0 +1,222 @@
+import heapq
+import logging
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from recipes.models import IngredientRecipe
+
+logger = logging.getLogger(__name__)
+
+VERSION_KEY = 'recipe_index:version'
+DELTA_KEY_PREFIX = 'recipe_index:delta:'
+DELTA_TIMEOUT = 3600
+MAX_DELTAS = 1000
+INDEX_TTL = 300
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс ингредиент -> отсортированные id рецептов.
+
+    Индекс строится в памяти процесса при первом запросе. Каждое изменение
+    рецепта получает номер версии в общем кеше и сохраняется там же, так
+    что остальные процессы догоняют версию, применяя изменения к своему
+    индексу точечно. Если изменений не хватает (кеш их потерял или индекс
+    сброшен целиком) или с загрузки прошло INDEX_TTL секунд, индекс
+    перестраивается в фоновом потоке, а запросы до замены обслуживает
+    прежний.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.postings = {}
+        self.recipes = {}
+        self.version = None
+        self.loaded_at = None
+        self.rebuilding = False
+
+    def shared_version(self):
+        self.init_version()
+        return cache.get(VERSION_KEY)
+
+    def init_version(self):
+        # Счетчик начинается с текущего времени в миллисекундах: если кеш
+        # вытеснит его, новые номера не совпадут с еще живыми изменениями.
+        cache.add(VERSION_KEY, int(time.time() * 1000), None)
+
+    def publish(self, delta=None):
+        """Увеличивает общую версию и сохраняет изменение под ее номером."""
+        self.init_version()
+        try:
+            version = cache.incr(VERSION_KEY)
+        except ValueError:
+            return None
+        if delta is not None:
+            cache.set(f'{DELTA_KEY_PREFIX}{version}', delta, DELTA_TIMEOUT)
+        return version
+
+    def read(self):
+        postings = {}
+        recipes = {}
+        rows = IngredientRecipe.objects.values_list(
+            'ingredient_id', 'recipe_id').order_by('ingredient_id',
+                                                   'recipe_id')
+        for ingredient_id, recipe_id in rows.iterator(chunk_size=10000):
+            postings.setdefault(ingredient_id, array('l')).append(recipe_id)
+            recipes.setdefault(recipe_id, []).append(ingredient_id)
+        return postings, {recipe_id: tuple(ingredients)
+                          for recipe_id, ingredients in recipes.items()}
+
+    def load(self, version, postings, recipes):
+        self.postings = postings
+        self.recipes = recipes
+        self.version = version
+        self.loaded_at = time.monotonic()
+
+    def rebuild(self):
+        """Читает индекс из базы без блокировки и подменяет текущий."""
+        version = self.shared_version()
+        postings, recipes = self.read()
+        with self.lock:
+            self.load(version, postings, recipes)
+
+    def run_rebuild(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Не удалось перестроить индекс рецептов')
+        finally:
+            self.rebuilding = False
+            connection.close()
+
+    def rebuild_in_background(self):
+        if not self.rebuilding:
+            self.rebuilding = True
+            threading.Thread(target=self.run_rebuild, daemon=True,
+                             name='recipe-index').start()
+
+    def apply_deltas(self, version):
+        if self.version is None:
+            return False
+        if not 0 < version - self.version <= MAX_DELTAS:
+            return False
+        keys = [f'{DELTA_KEY_PREFIX}{number}'
+                for number in range(self.version + 1, version + 1)]
+        deltas = cache.get_many(keys)
+        if len(deltas) != len(keys):
+            return False
+        for key in keys:
+            self.patch(*deltas[key])
+        self.version = version
+        return True
+
+    def ensure_loaded(self):
+        version = self.shared_version()
+        if self.loaded_at is None:
+            self.load(version, *self.read())
+        elif ((self.version != version and not self.apply_deltas(version))
+              or time.monotonic() - self.loaded_at > INDEX_TTL):
+            self.rebuild_in_background()
+
+    def invalidate(self):
+        """Сбрасывает индекс во всех процессах после фиксации транзакции."""
+        transaction.on_commit(self.reset)
+
+    def reset(self):
+        self.publish()
+        with self.lock:
+            self.version = None
+
+    def patch(self, recipe_id, ingredient_ids):
+        for ingredient_id in self.recipes.pop(recipe_id, ()):
+            postings = self.postings[ingredient_id]
+            position = bisect_left(postings, recipe_id)
+            if (position < len(postings)
+                    and postings[position] == recipe_id):
+                postings.pop(position)
+        if ingredient_ids:
+            self.recipes[recipe_id] = tuple(ingredient_ids)
+        for ingredient_id in ingredient_ids:
+            postings = self.postings.setdefault(ingredient_id, array('l'))
+            postings.insert(bisect_left(postings, recipe_id), recipe_id)
+
+    def apply(self, recipe_id, ingredient_ids):
+        version = self.publish((recipe_id, tuple(ingredient_ids)))
+        with self.lock:
+            if self.loaded_at is None:
+                return
+            self.patch(recipe_id, ingredient_ids)
+            if (version is not None and self.version is not None
+                    and version == self.version + 1):
+                self.version = version
+
+    def set_recipe(self, recipe_id, ingredient_ids):
+        """Заменяет набор ингредиентов рецепта после фиксации транзакции."""
+        ingredient_ids = sorted(set(ingredient_ids))
+        transaction.on_commit(lambda: self.apply(recipe_id, ingredient_ids))
+
+    def reload_recipes(self, recipe_ids):
+        """Перечитывает ингредиенты рецептов после фиксации транзакции."""
+        recipe_ids = set(recipe_ids)
+
+        def reload():
+            ingredients = {recipe_id: set() for recipe_id in recipe_ids}
+            rows = IngredientRecipe.objects.filter(
+                recipe_id__in=recipe_ids).values_list('recipe_id',
+                                                      'ingredient_id')
+            for recipe_id, ingredient_id in rows:
+                ingredients[recipe_id].add(ingredient_id)
+            for recipe_id, ingredient_ids in ingredients.items():
+                self.apply(recipe_id, sorted(ingredient_ids))
+        transaction.on_commit(reload)
+
+    def remove_recipe(self, recipe_id):
+        transaction.on_commit(lambda: self.apply(recipe_id, ()))
+
+    def match(self, ingredient_ids, max_missing=None):
+        with self.lock:
+            self.ensure_loaded()
+            matched = Counter()
+            for ingredient_id in set(ingredient_ids):
+                matched.update(self.postings.get(ingredient_id, ()))
+            keys = []
+            for recipe_id, count in matched.items():
+                total = len(self.recipes[recipe_id])
+                missing = total - count
+                if max_missing is None or missing <= max_missing:
+                    keys.append((-count / total, missing, -recipe_id))
+        return RecipeMatches(keys)
+
+
+class RecipeMatches:
+    """Результат подбора рецептов, отсортированный при обращении к срезу.
+
+    Полная сортировка не нужна: для страницы достаточно первых
+    offset + limit элементов, которые выбираются через кучу.
+    """
+
+    def __init__(self, keys):
+        self.keys = keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def count(self):
+        return len(self.keys)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            return self[index:index + 1][0]
+        stop = len(self.keys) if index.stop is None else index.stop
+        top = heapq.nsmallest(stop, self.keys)
+        return [
+            {'id': -recipe_id, 'coverage': -coverage, 'missing': missing}
+            for coverage, missing, recipe_id in top[index.start:stop]
+        ]
+
+
+recipe_index = RecipeIngredientIndex()
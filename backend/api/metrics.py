@@ -0,0 +1,282 @@
+import atexit
+import bisect
+import hmac
+import ipaddress
+import json
+import os
+import threading
+import time
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+HELP = {
+    'foodgram_requests_total': ('counter', 'Количество запросов'),
+    'foodgram_request_duration_seconds': (
+        'histogram', 'Время ответа в секундах'),
+    'foodgram_db_queries_total': ('counter', 'Количество SQL-запросов'),
+    'foodgram_db_query_seconds_total': (
+        'counter', 'Суммарное время SQL-запросов в секундах'),
+    'foodgram_cache_requests_total': (
+        'counter', 'Обращения к кешу по результату (hit/miss)'),
+    'foodgram_worker_requests_total': (
+        'counter', 'Количество запросов по процессам gunicorn'),
+    'foodgram_workers': ('gauge', 'Количество живых процессов gunicorn'),
+}
+
+
+class MetricsStore:
+    """Метрики процесса, сбрасываемые в общий каталог.
+
+    Каждый процесс пишет только свой файл ``<pid>.json``, поэтому
+    блокировки между процессами не нужны, а эндпоинт суммирует все файлы.
+    Файл завершившегося процесса забирает себе тот, кто первым его
+    переименует: счетчики прибавляются к своим, а файл удаляется, так что
+    суммы не уменьшаются, а каталог не растет с перезапусками воркеров.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.counters = {}
+        self.histograms = {}
+        self.flushed_at = 0.0
+
+    def check_fork(self):
+        if self.pid != os.getpid():
+            self.reset()
+
+    @property
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f'{self.pid}.json')
+
+    def inc(self, name, labels, value=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.check_fork()
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def get_histogram(self, key):
+        return self.histograms.setdefault(key, {
+            'buckets': [0] * (len(LATENCY_BUCKETS) + 1),
+            'sum': 0.0,
+            'count': 0,
+        })
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.check_fork()
+            histogram = self.get_histogram(key)
+            histogram['buckets'][
+                bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': [[name, dict(labels), value] for (name, labels),
+                             value in self.counters.items()],
+                'histograms': [[name, dict(labels), histogram]
+                               for (name, labels), histogram
+                               in self.histograms.items()],
+            }
+
+    def flush(self):
+        if not self.counters and not self.histograms:
+            return
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        temporary = f'{self.path}.{threading.get_ident()}.tmp'
+        with open(temporary, 'w', encoding='utf-8') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(temporary, self.path)
+        self.flushed_at = time.monotonic()
+
+    def maybe_flush(self):
+        elapsed = time.monotonic() - self.flushed_at
+        if elapsed >= settings.METRICS_FLUSH_INTERVAL:
+            self.flush()
+
+    def fold(self, path):
+        """Забирает счетчики завершившегося процесса в свой файл."""
+        claimed = f'{path}.{self.pid}.fold'
+        # Переименовать файл успеет только один процесс, остальные получат
+        # FileNotFoundError и пропустят его.
+        os.rename(path, claimed)
+        with open(claimed, encoding='utf-8') as file:
+            snapshot = json.load(file)
+        with self.lock:
+            self.check_fork()
+            for name, labels, value in snapshot['counters']:
+                if name == 'foodgram_worker_requests_total':
+                    continue
+                key = (name, tuple(sorted(labels.items())))
+                self.counters[key] = self.counters.get(key, 0) + value
+            for name, labels, histogram in snapshot['histograms']:
+                total = self.get_histogram(
+                    (name, tuple(sorted(labels.items()))))
+                for index, count in enumerate(histogram['buckets']):
+                    total['buckets'][index] += count
+                total['sum'] += histogram['sum']
+                total['count'] += histogram['count']
+        self.flush()
+        os.remove(claimed)
+
+    def read_all(self):
+        """Возвращает снимки всех процессов и pid живых процессов."""
+        snapshots = []
+        alive = {self.pid}
+        threshold = time.time() - 3 * settings.METRICS_FLUSH_INTERVAL
+        if os.path.isdir(settings.METRICS_DIR):
+            names = os.listdir(settings.METRICS_DIR)
+        else:
+            names = []
+        for name in names:
+            if not name.endswith('.json') or name == f'{self.pid}.json':
+                continue
+            path = os.path.join(settings.METRICS_DIR, name)
+            try:
+                pid = int(name[:-len('.json')])
+                if os.path.getmtime(path) >= threshold:
+                    alive.add(pid)
+                elif not is_running(pid):
+                    self.fold(path)
+                    continue
+                with open(path, encoding='utf-8') as file:
+                    snapshots.append(json.load(file))
+            except (OSError, ValueError):
+                continue
+        # Свой снимок берется последним: в нем уже счетчики забранных файлов.
+        return [self.snapshot()] + snapshots, alive
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+store = MetricsStore()
+atexit.register(store.flush)
+
+
+def is_allowed(request):
+    """Доступ к метрикам: адрес из METRICS_ALLOWED_IPS или METRICS_TOKEN."""
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if token and hmac.compare_digest(authorization, f'Bearer {token}'):
+        return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network.strip(), strict=False)
+               for network in settings.METRICS_ALLOWED_IPS if network.strip())
+
+
+def get_view_label(request):
+    match = request.resolver_match
+    if match is None:
+        return 'unresolved'
+    view_class = getattr(match.func, 'cls', None)
+    if view_class is None:
+        return match.view_name or match.func.__name__
+    actions = getattr(match.func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+def record_request(request, status, duration, queries, queries_duration):
+    view = get_view_label(request)
+    store.inc('foodgram_requests_total',
+              {'view': view, 'method': request.method, 'status': str(status)})
+    store.observe('foodgram_request_duration_seconds', {'view': view},
+                  duration)
+    store.inc('foodgram_db_queries_total', {'view': view}, queries)
+    store.inc('foodgram_db_query_seconds_total', {'view': view},
+              queries_duration)
+    store.inc('foodgram_worker_requests_total', {'pid': str(os.getpid())})
+    store.maybe_flush()
+
+
+def record_cache(cache_name, hit):
+    store.inc('foodgram_cache_requests_total',
+              {'cache': cache_name, 'result': 'hit' if hit else 'miss'})
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in sorted(labels.items())
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def merge(snapshots, alive):
+    counters = {}
+    histograms = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            if (name == 'foodgram_worker_requests_total'
+                    and int(labels['pid']) not in alive):
+                continue
+            key = (name, format_labels(labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, histogram in snapshot['histograms']:
+            key = (name, format_labels(labels))
+            total = histograms.setdefault(key, {
+                'buckets': [0] * len(histogram['buckets']),
+                'sum': 0.0,
+                'count': 0,
+            })
+            for index, count in enumerate(histogram['buckets']):
+                total['buckets'][index] += count
+            total['sum'] += histogram['sum']
+            total['count'] += histogram['count']
+    return counters, histograms
+
+
+def render_histogram(name, labels, histogram):
+    base = labels[1:-1]
+    cumulative = 0
+    bounds = [str(bound) for bound in LATENCY_BUCKETS] + ['+Inf']
+    for bound, count in zip(bounds, histogram['buckets']):
+        cumulative += count
+        bucket_labels = f'{base},le="{bound}"' if base else f'le="{bound}"'
+        yield f'{name}_bucket{{{bucket_labels}}} {cumulative}'
+    yield f'{name}_sum{labels} {histogram["sum"]}'
+    yield f'{name}_count{labels} {histogram["count"]}'
+
+
+def render_metrics():
+    """Собирает метрики всех процессов в текстовом формате Prometheus."""
+    store.maybe_flush()
+    snapshots, alive = store.read_all()
+    counters, histograms = merge(snapshots, alive)
+    lines = []
+    for name, (metric_type, description) in HELP.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {metric_type}')
+        if name == 'foodgram_workers':
+            lines.append(f'{name} {len(alive)}')
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{labels} {value}')
+        for (metric, labels), histogram in sorted(histograms.items()):
+            if metric == name:
+                lines.extend(render_histogram(name, labels, histogram))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,174 @@
+import bisect
+import heapq
+import logging
+import sys
+import threading
+import time
+from pathlib import Path
+
+from api.metrics import record_request
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+API_DIR = str(Path(__file__).resolve().parent)
+HISTOGRAM_BOUNDS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500)
+
+
+def find_origin():
+    """Возвращает первый кадр стека из кода приложения api."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        filename = frame.f_code.co_filename
+        if filename.startswith(API_DIR) and filename != __file__:
+            return f'{Path(filename).name}:{frame.f_lineno}'
+        frame = frame.f_back
+    return '-'
+
+
+class QueryRecorder:
+    def __init__(self, slowest):
+        self.count = 0
+        self.duration = 0.0
+        self.slowest = []
+        self.slowest_size = slowest
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = (time.perf_counter() - started) * 1000
+            self.count += 1
+            self.duration += duration
+            if len(self.slowest) < self.slowest_size:
+                heapq.heappush(self.slowest, (duration, find_origin()))
+            elif self.slowest and duration > self.slowest[0][0]:
+                heapq.heapreplace(self.slowest, (duration, find_origin()))
+
+
+class RouteStats:
+    """Гистограммы времени ответа по маршрутам за интервал."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.routes = {}
+        self.started = time.monotonic()
+
+    def add(self, route, total, queries):
+        with self.lock:
+            stats = self.routes.setdefault(route, {
+                'count': 0, 'queries': 0, 'total': 0.0,
+                'buckets': [0] * (len(HISTOGRAM_BOUNDS) + 1),
+            })
+            stats['count'] += 1
+            stats['queries'] += queries
+            stats['total'] += total
+            stats['buckets'][bisect.bisect_left(HISTOGRAM_BOUNDS, total)] += 1
+
+    def flush(self, interval):
+        with self.lock:
+            if time.monotonic() - self.started < interval:
+                return None
+            routes, self.routes = self.routes, {}
+            self.started = time.monotonic()
+        return routes
+
+
+def format_histogram(buckets):
+    labels = [f'<={bound}' for bound in HISTOGRAM_BOUNDS] + ['>']
+    return ' '.join(f'{label}:{count}'
+                    for label, count in zip(labels, buckets) if count)
+
+
+class ProfilingMiddleware:
+    """Замеряет SQL, время представления и рендеринга для каждого запроса.
+
+    Результат отдается в заголовке Server-Timing, а сводные гистограммы
+    по маршрутам периодически пишутся в лог.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILE_REQUESTS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.stats = RouteStats()
+
+    def __call__(self, request):
+        recorder = QueryRecorder(settings.PROFILE_SLOW_QUERIES)
+        request.profile = {'recorder': recorder}
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        finished = time.perf_counter()
+
+        total = (finished - started) * 1000
+        profile = request.profile
+        metrics = [f'db;dur={recorder.duration:.1f};'
+                   f'desc="{recorder.count} queries"']
+        if 'view_started' in profile:
+            view_end = profile.get('render_started', finished)
+            view = (view_end - profile['view_started']) * 1000
+            view_db = profile.get(
+                'view_db', recorder.duration - profile['view_db_start'])
+            metrics.append(f'app;dur={max(0.0, view - view_db):.1f};'
+                           'desc="view and serializers without SQL"')
+        if 'render_started' in profile:
+            render = (finished - profile['render_started']) * 1000
+            metrics.append(f'render;dur={render:.1f}')
+        for index, (duration, origin) in enumerate(
+                sorted(recorder.slowest, reverse=True), 1):
+            metrics.append(f'sql-{index};dur={duration:.1f};desc="{origin}"')
+        metrics.append(f'total;dur={total:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        match = request.resolver_match
+        route = match.view_name if match else 'unresolved'
+        self.stats.add(f'{request.method} {route}', total, recorder.count)
+        self.log_stats()
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request.profile['view_started'] = time.perf_counter()
+        request.profile['view_db_start'] = request.profile['recorder'].duration
+
+    def process_template_response(self, request, response):
+        profile = request.profile
+        profile['render_started'] = time.perf_counter()
+        if 'view_db_start' in profile:
+            profile['view_db'] = (profile['recorder'].duration
+                                  - profile['view_db_start'])
+        return response
+
+    def log_stats(self):
+        routes = self.stats.flush(settings.PROFILE_LOG_INTERVAL)
+        if not routes:
+            return
+        for route, stats in sorted(routes.items()):
+            logger.info(
+                '%s n=%d avg=%.1fms queries=%.1f %s', route, stats['count'],
+                stats['total'] / stats['count'],
+                stats['queries'] / stats['count'],
+                format_histogram(stats['buckets']))
+
+
+class MetricsMiddleware:
+    """Считает запросы, время ответа и SQL по представлениям для /api/metrics.
+    """
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        recorder = QueryRecorder(0)
+        started = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        record_request(request, response.status_code,
+                       time.perf_counter() - started,
+                       recorder.count, recorder.duration / 1000)
+        return response
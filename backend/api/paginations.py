@@ -1,5 +1,49 @@
-from rest_framework.pagination import PageNumberPagination
+import math
+
+from django.core.exceptions import ValidationError
+from django.db.models import IntegerField
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class LimitPagination(PageNumberPagination):
     page_size_query_param = "limit"
+
+
+class CursorLimitPagination(CursorPagination):
+    """Пагинация по курсору без COUNT и OFFSET.
+
+    Порядок, заданный запросом (фильтр ordering, релевантность поиска),
+    сохраняется: курсор хранит значение первого поля сортировки, а рецепты
+    с одинаковым значением DRF различает смещением.
+    """
+
+    ordering = ('-id',)
+    page_size_query_param = 'limit'
+    position_field = IntegerField()
+
+    @staticmethod
+    def is_requested(request):
+        return ('cursor' in request.query_params
+                or request.query_params.get('pagination') == 'cursor')
+
+    def get_ordering(self, request, queryset, view):
+        ordering = queryset.query.order_by or self.ordering
+        name = ordering[0].lstrip('-')
+        annotation = queryset.query.annotations.get(name)
+        self.position_field = (
+            annotation.output_field if annotation is not None
+            else queryset.model._meta.get_field(name))
+        return ordering
+
+    def decode_cursor(self, request):
+        cursor = super().decode_cursor(request)
+        if cursor is not None and cursor.position is not None:
+            try:
+                position = self.position_field.to_python(cursor.position)
+            except ValidationError:
+                position = None
+            if (not isinstance(position, (int, float))
+                    or not math.isfinite(position)):
+                raise NotFound(self.invalid_cursor_message)
+        return cursor
@@ -0,0 +1,47 @@
+import json
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.negotiation import BaseContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, str):
+            return data.encode(self.charset)
+        return json.dumps(data, ensure_ascii=False).encode(self.charset)
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+
+
+class ShoppingCartNegotiation(BaseContentNegotiation):
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        export_format = format_suffix or request.query_params.get('format')
+        if not export_format:
+            return renderers[0], renderers[0].media_type
+        for renderer in renderers:
+            if renderer.format == export_format:
+                return renderer, renderer.media_type
+        raise ValidationError({
+            'format': 'Неподдерживаемый формат, доступны: '
+                      + ', '.join(renderer.format for renderer in renderers)
+        })
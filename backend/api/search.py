@@ -0,0 +1,184 @@
+import re
+import time
+from bisect import bisect_left
+
+from django.db import connection
+from django.db.models import (BooleanField, Case, FloatField, IntegerField, Q,
+                              Value, When)
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Replace, Upper
+from recipes.models import Ingredient
+
+SEARCH_LIMIT = 50
+INDEX_TTL = 300
+SEARCH_CONFIG = 'russian'
+WORD = re.compile(r'\w+')
+
+INGREDIENT_NAMES_SQL = (
+    "SELECT {aggregate} FROM recipes_ingredientrecipe ir "
+    "JOIN recipes_ingredient i ON i.id = ir.ingredient_id "
+    "WHERE ir.recipe_id = recipes_recipe.id"
+)
+REFRESH_SEARCH_SQL = {
+    'postgresql': [
+        "UPDATE recipes_recipe SET search_vector = "
+        "setweight(to_tsvector('russian', name), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(({}), '')), 'B') || "
+        "setweight(to_tsvector('russian', text), 'C') "
+        "WHERE id IN ({{ids}})".format(INGREDIENT_NAMES_SQL.format(
+            aggregate="string_agg(i.name, ' ')")),
+    ],
+    'sqlite': [
+        'DELETE FROM recipes_recipe_fts WHERE rowid IN ({ids})',
+        'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+        "SELECT id, name, coalesce(({}), ''), text FROM recipes_recipe "
+        'WHERE id IN ({{ids}})'.format(INGREDIENT_NAMES_SQL.format(
+            aggregate="group_concat(i.name, ' ')")),
+    ],
+}
+
+# В PostgreSQL поисковый вектор хранится в строке рецепта и удаляется с ней.
+DELETE_SEARCH_SQL = {
+    'sqlite': 'DELETE FROM recipes_recipe_fts WHERE rowid IN ({ids})',
+}
+
+
+def normalize(value):
+    return value.casefold().replace('ё', 'е')
+
+
+def normalize_upper(value):
+    """Приведение normalize для PostgreSQL, где индексы по верхнему регистру.
+    """
+    return value.upper().replace('Ё', 'Е')
+
+
+# Совпадает с выражением индексов из миграции 0025_ingredient_search_fold.
+FOLDED_NAME = Replace(Upper('name'), Value('Ё'), Value('Е'))
+
+
+class IngredientIndex:
+    """Отсортированный список названий ингредиентов для поиска в памяти."""
+
+    def __init__(self):
+        self.names = []
+        self.ids = []
+        self.loaded_at = None
+
+    def invalidate(self):
+        self.loaded_at = None
+
+    def load(self):
+        rows = sorted(
+            (normalize(name), pk)
+            for pk, name in Ingredient.objects.values_list('id', 'name')
+        )
+        self.names = [name for name, _ in rows]
+        self.ids = [pk for _, pk in rows]
+        self.loaded_at = time.monotonic()
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        if (self.loaded_at is None
+                or time.monotonic() - self.loaded_at > INDEX_TTL):
+            self.load()
+        query = normalize(query)
+        result = []
+        position = bisect_left(self.names, query)
+        while (len(result) < limit and position < len(self.names)
+               and self.names[position].startswith(query)):
+            result.append(self.ids[position])
+            position += 1
+        found = set(result)
+        for name, pk in zip(self.names, self.ids):
+            if len(result) >= limit:
+                break
+            if query in name and pk not in found:
+                result.append(pk)
+        return result
+
+
+ingredient_index = IngredientIndex()
+
+
+def search_ingredients(queryset, query, limit=SEARCH_LIMIT):
+    """Поиск по названию: сначала совпадения с начала, затем по подстроке."""
+    if connection.vendor == 'postgresql':
+        query = normalize_upper(query)
+        return queryset.annotate(folded_name=FOLDED_NAME).filter(
+            folded_name__contains=query
+        ).annotate(
+            rank=Case(
+                When(folded_name__startswith=query, then=Value(0)),
+                default=Value(1),
+                output_field=IntegerField(),
+            )
+        ).order_by('rank', 'name')[:limit]
+    ids = ingredient_index.search(query, limit)
+    if not ids:
+        return queryset.none()
+    return queryset.filter(id__in=ids).order_by(Case(
+        *[When(id=pk, then=Value(position))
+          for position, pk in enumerate(ids)],
+        output_field=IntegerField(),
+    ))
+
+
+def refresh_recipe_search(recipe_ids):
+    """Пересчитывает полнотекстовый индекс для заданных рецептов."""
+    recipe_ids = [int(pk) for pk in recipe_ids]
+    statements = REFRESH_SEARCH_SQL.get(connection.vendor)
+    if not recipe_ids or statements is None:
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement.format(ids=placeholders), recipe_ids)
+
+
+def remove_recipe_search(recipe_ids):
+    """Удаляет строки полнотекстового индекса удаленных рецептов."""
+    recipe_ids = [int(pk) for pk in recipe_ids]
+    statement = DELETE_SEARCH_SQL.get(connection.vendor)
+    if not recipe_ids or statement is None:
+        return
+    placeholders = ', '.join(['%s'] * len(recipe_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(statement.format(ids=placeholders), recipe_ids)
+
+
+def search_recipes(queryset, query):
+    """Полнотекстовый поиск по названию, ингредиентам и описанию.
+
+    Результаты упорядочены по релевантности, в том числе при пагинации
+    по курсору.
+    """
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery(%s, %s)"
+        params = (SEARCH_CONFIG, query)
+        match = RawSQL(f'recipes_recipe.search_vector @@ {tsquery}', params,
+                       output_field=BooleanField())
+        # ts_rank возвращает real: приведение к double precision дает
+        # значение, которое без потерь проходит через позицию курсора.
+        rank = RawSQL(
+            f'ts_rank(recipes_recipe.search_vector, {tsquery})::float8',
+            params, output_field=FloatField())
+    elif connection.vendor == 'sqlite':
+        words = WORD.findall(query.lower())
+        if not words:
+            return queryset.none()
+        match_query = ' '.join(f'"{word}"*' for word in words)
+        match = RawSQL(
+            'recipes_recipe.id IN (SELECT rowid FROM recipes_recipe_fts '
+            'WHERE recipes_recipe_fts MATCH %s)', (match_query,),
+            output_field=BooleanField())
+        rank = RawSQL(
+            '(SELECT -bm25(recipes_recipe_fts, 10.0, 5.0, 1.0) '
+            'FROM recipes_recipe_fts WHERE recipes_recipe_fts MATCH %s '
+            'AND rowid = recipes_recipe.id)', (match_query,),
+            output_field=FloatField())
+    else:
+        return queryset.filter(
+            Q(name__icontains=query) | Q(text__icontains=query)
+            | Q(ingredients__name__icontains=query)).distinct()
+    return queryset.filter(match).annotate(
+        search_rank=rank).order_by('-search_rank', '-id')
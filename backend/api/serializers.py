@@ -1,11 +1,18 @@
-import base64
+import binascii
 
+from api.matching import recipe_index
+from api.search import refresh_recipe_search
+from api.utils import decode_base64, get_recipes_limit
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.images import schedule_image_processing
+from recipes.models import (CartIngredient, Ingredient, IngredientRecipe,
+                            Recipe, Tag)
 from rest_framework import serializers, status
-from users.models import Subscribe
 
 User = get_user_model()
 
@@ -21,6 +28,8 @@ class CustomUserSerializer(UserSerializer):
         )
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         user = self.context.get('request').user
         return (
             user.is_authenticated
@@ -41,22 +50,44 @@ class Base64ImageField(serializers.ImageField):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            if len(imgstr) * 3 // 4 > settings.RECIPE_IMAGE_MAX_SIZE:
+                raise serializers.ValidationError(
+                    'Размер картинки не может превышать '
+                    f'{settings.RECIPE_IMAGE_MAX_SIZE} байт')
+            try:
+                data = File(decode_base64(imgstr), name='temp.' + ext)
+            except binascii.Error:
+                raise serializers.ValidationError(
+                    'Некорректная картинка в base64')
 
         return super().to_internal_value(data)
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    def to_representation(self, value):
+        request = self.context.get('request')
+        variants = {}
+        for key, path in value.items():
+            if not path.startswith('data:'):
+                path = default_storage.url(path)
+                if request is not None:
+                    path = request.build_absolute_uri(path)
+            variants[key] = path
+        return variants
+
+
 class RecipeReadShortSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time',)
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time',)
 
 
 class SubscribeSerializer(CustomUserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -67,11 +98,6 @@ class SubscribeSerializer(CustomUserSerializer):
     def validate(self, attrs):
         author = self.instance
         user = self.context.get('request').user
-        if Subscribe.objects.filter(author=author, user=user).exists():
-            raise serializers.ValidationError(
-                'Вы уже подписаны на этого пользователя',
-                code=status.HTTP_400_BAD_REQUEST
-            )
         if user == author:
             raise serializers.ValidationError(
                 'Вы пытаетесь подписаться на самого себя',
@@ -79,12 +105,13 @@ class SubscribeSerializer(CustomUserSerializer):
             )
         return attrs
 
-    def get_recipes_count(self, obj):
-        return obj.recipes.count()
-
     def get_recipes(self, obj):
-        all_recipes = obj.recipes.all()
-        return RecipeReadShortSerializer(all_recipes, many=True,
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()[:get_recipes_limit(
+                self.context.get('request'))]
+        return RecipeReadShortSerializer(recipes, many=True,
                                          read_only=True).data
 
 
@@ -118,31 +145,50 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     ingredients = IngredientRecipeReadSerializer(many=True, read_only=True,
                                                  source='ingredients_recipe')
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
         model = Recipe
         fields = (
-            'id', 'author', 'name', 'image', 'text', 'ingredients',
-            'tags', 'cooking_time', 'is_favorited', 'is_in_shopping_cart'
+            'id', 'author', 'name', 'image', 'image_variants', 'text',
+            'ingredients', 'tags', 'cooking_time', 'is_favorited',
+            'is_in_shopping_cart'
         )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return user.favorites.filter(recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
         return user.cart.filter(recipe=obj).exists()
 
 
+class RecipeMatchSerializer(RecipeReadSerializer):
+    coverage = serializers.FloatField(read_only=True)
+    missing = serializers.IntegerField(read_only=True)
+
+    class Meta(RecipeReadSerializer.Meta):
+        fields = RecipeReadSerializer.Meta.fields + ('coverage', 'missing')
+
+
 class IngredientRecipeWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField()
 
     class Meta:
@@ -151,8 +197,7 @@ class IngredientRecipeWriteSerializer(serializers.ModelSerializer):
 
 
 class RecipeWtiteSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = serializers.ListField(child=serializers.IntegerField())
     ingredients = IngredientRecipeWriteSerializer(many=True)
     image = Base64ImageField()
     cooking_time = serializers.IntegerField()
@@ -165,7 +210,6 @@ class RecipeWtiteSerializer(serializers.ModelSerializer):
 
     def validate(self, attrs):
         ingredients = attrs.get('ingredients', [])
-        ingredients_id = []
         if not ingredients:
             raise serializers.ValidationError(
                 "ингредиенты обязательны для добавления")
@@ -174,19 +218,32 @@ class RecipeWtiteSerializer(serializers.ModelSerializer):
         if attrs.get('cooking_time') <= 0:
             raise serializers.ValidationError(
                 "время приготовления не может быть <= 0")
+        ingredients_id = [item['id'] for item in ingredients]
+        if len(set(ingredients_id)) != len(ingredients_id):
+            raise serializers.ValidationError(
+                "нельзя добавить два одинаковых ингредиента")
+        if any(item['amount'] <= 0 for item in ingredients):
+            raise serializers.ValidationError(
+                "количество ингредиентов не может быть <= 0")
+        errors = {}
+        found_ingredients = self.get_objects(Ingredient, ingredients_id,
+                                             'ingredients', errors)
+        found_tags = self.get_objects(Tag, attrs['tags'], 'tags', errors)
+        if errors:
+            raise serializers.ValidationError(errors)
         for item in ingredients:
-            now_id = item.get('id')
-            amount = item.get('amount')
-            if now_id not in ingredients_id:
-                ingredients_id.append(now_id)
-            else:
-                raise serializers.ValidationError(
-                    "нельзя добавить два одинаковых ингредиента")
-            if amount <= 0:
-                raise serializers.ValidationError(
-                    "количество ингредиентов не может быть <= 0")
+            item['id'] = found_ingredients[item['id']]
+        attrs['tags'] = list(found_tags.values())
         return attrs
 
+    def get_objects(self, model, ids, field, errors):
+        found = model.objects.in_bulk(set(ids))
+        missing = sorted(set(ids) - found.keys())
+        if missing:
+            errors[field] = ('Не найдены объекты с id: '
+                             + ', '.join(map(str, missing)))
+        return found
+
     def get_ingredients(self, ingredients, recipe):
         ingredients_recipes = []
         for ingredient in ingredients:
@@ -207,20 +264,94 @@ class RecipeWtiteSerializer(serializers.ModelSerializer):
         IngredientRecipe.objects.bulk_create(self.get_ingredients
                                              (recipe=recipe,
                                               ingredients=ingredients))
+        refresh_recipe_search([recipe.pk])
+        recipe_index.set_recipe(recipe.pk, [item['id'].id
+                                            for item in ingredients])
+        schedule_image_processing(recipe)
         return recipe
 
+    def update_tags(self, recipe, tags):
+        through = Recipe.tags.through
+        current = set(through.objects.filter(recipe=recipe)
+                      .values_list('tag_id', flat=True))
+        new = {tag.id for tag in tags}
+        if current - new:
+            through.objects.filter(recipe=recipe,
+                                   tag_id__in=current - new).delete()
+        if new - current:
+            through.objects.bulk_create(
+                through(recipe=recipe, tag_id=tag_id)
+                for tag_id in new - current
+            )
+        return current != new
+
+    def update_ingredients(self, recipe, ingredients):
+        current = {item.ingredient_id: item
+                   for item in recipe.ingredients_recipe.all()}
+        new = {item['id'].id: item['amount'] for item in ingredients}
+        removed = current.keys() - new.keys()
+        added = [
+            IngredientRecipe(recipe=recipe, ingredient_id=ingredient_id,
+                             amount=amount)
+            for ingredient_id, amount in new.items()
+            if ingredient_id not in current
+        ]
+        changed = []
+        deltas = {ingredient_id: -current[ingredient_id].amount
+                  for ingredient_id in removed}
+        deltas.update((item.ingredient_id, item.amount) for item in added)
+        for ingredient_id, item in current.items():
+            if ingredient_id in new and item.amount != new[ingredient_id]:
+                deltas[ingredient_id] = new[ingredient_id] - item.amount
+                item.amount = new[ingredient_id]
+                changed.append(item)
+        if removed:
+            IngredientRecipe.objects.filter(
+                pk__in=[current[ingredient_id].pk
+                        for ingredient_id in removed]).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ['amount'])
+        if added:
+            IngredientRecipe.objects.bulk_create(added)
+        if removed or added:
+            recipe_index.set_recipe(recipe.pk, new)
+        if deltas:
+            CartIngredient.objects.apply_deltas(
+                recipe.cart.values_list('user_id', flat=True), deltas)
+        return bool(deltas)
+
+    def same_image(self, recipe, image):
+        field = recipe.image.field
+        content_name = getattr(field.storage, 'content_name', None)
+        if content_name is None or not recipe.image:
+            return False
+        name = field.generate_filename(recipe, image.name)
+        return recipe.image.name == content_name(name, image)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         ingredients = validated_data.pop('ingredients')
-        instance.tags.clear()
-        instance.tags.add(*tags)
-        IngredientRecipe.objects.filter(recipe=instance).delete()
-        for field, value in validated_data.items():
-            setattr(instance, field, value)
-        IngredientRecipe.objects.bulk_create(self.get_ingredients
-                                             (recipe=instance,
-                                              ingredients=ingredients))
-        instance.save()
+        tags_changed = self.update_tags(instance, tags)
+        ingredients_changed = self.update_ingredients(instance, ingredients)
+        image = validated_data.get('image')
+        if image is not None and self.same_image(instance, image):
+            validated_data.pop('image')
+        update_fields = [
+            field for field, value in validated_data.items()
+            if getattr(instance, field) != value
+        ]
+        for field in update_fields:
+            setattr(instance, field, validated_data[field])
+        if 'image' in update_fields:
+            instance.image_variants = {}
+            update_fields.append('image_variants')
+        if update_fields or tags_changed or ingredients_changed:
+            instance.save(update_fields=update_fields + ['updated_at'])
+        if ingredients_changed:
+            refresh_recipe_search([instance.pk])
+        if 'image' in update_fields:
+            schedule_image_processing(instance)
         return instance
 
     def to_representation(self, instance):
@@ -0,0 +1,64 @@
+from api.cache import invalidate_catalog, invalidate_tag_ids
+from api.feed import invalidate_author_feed
+from api.matching import recipe_index
+from api.search import (ingredient_index, refresh_recipe_search,
+                        remove_recipe_search)
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from recipes.models import Ingredient, IngredientRecipe, Recipe, Tag
+from recipes.signals import ingredients_imported, recipe_ingredients_changed
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(ingredients_imported)
+def invalidate_ingredients(sender, **kwargs):
+    ingredient_index.invalidate()
+    invalidate_catalog('ingredients')
+
+
+@receiver(post_delete, sender=Ingredient)
+def invalidate_recipe_index(sender, **kwargs):
+    recipe_index.invalidate()
+
+
+@receiver(post_delete, sender=Recipe)
+def remove_recipe_from_index(sender, instance, **kwargs):
+    recipe_index.remove_recipe(instance.pk)
+    remove_recipe_search([instance.pk])
+
+
+# API меняет ингредиенты рецепта массовыми запросами и обновляет индексы
+# сам. Приемников post_save/post_delete у IngredientRecipe нет намеренно:
+# с ними Django не может удалять строки одним запросом.
+@receiver(recipe_ingredients_changed)
+def refresh_recipe_ingredients(sender, recipe_ids, **kwargs):
+    refresh_recipe_search(recipe_ids)
+    recipe_index.reload_recipes(recipe_ids)
+
+
+@receiver(post_save, sender=Recipe)
+def refresh_saved_recipe_search(sender, instance, update_fields, **kwargs):
+    if update_fields is None or {'name', 'text'} & update_fields:
+        refresh_recipe_search([instance.pk])
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def invalidate_recipe_author_feed(sender, instance, created=True, **kwargs):
+    if created:
+        invalidate_author_feed(instance.author_id)
+
+
+@receiver(post_save, sender=Ingredient)
+def refresh_ingredient_recipes_search(sender, instance, created, **kwargs):
+    if not created:
+        refresh_recipe_search(IngredientRecipe.objects.filter(
+            ingredient=instance).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    invalidate_tag_ids()
+    invalidate_catalog('tags')
@@ -0,0 +1,693 @@
+import base64
+import json
+import os
+import subprocess
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from recipes.admin import IngredientRecipeAdmin
+from recipes.models import (CartIngredient, Favorite, Ingredient,
+                            IngredientRecipe, Recipe, ShoppingCart,
+                            SimilarRecipe, Tag)
+from recipes.ranking import score_increments
+from reportlab.pdfbase import pdfmetrics
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APITestCase
+from users.models import Subscribe
+
+from .matching import INDEX_TTL, RecipeIngredientIndex, recipe_index
+from .metrics import MetricsStore, merge
+from .search import search_recipes
+from .serializers import RecipeWtiteSerializer
+from .utils import PDF_FONT_NAME
+
+User = get_user_model()
+
+
+def create_user(index):
+    return User.objects.create_user(
+        email=f'user{index}@example.com', username=f'user{index}',
+        password='password', first_name='Имя', last_name='Фамилия')
+
+
+class CountersTest(APITestCase):
+
+    def setUp(self):
+        self.author = create_user(0)
+        self.user = create_user(1)
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+        self.client.force_authenticate(self.user)
+
+    def counters(self):
+        self.recipe.refresh_from_db()
+        self.author.refresh_from_db()
+        return (self.recipe.favorites_count, self.recipe.cart_count,
+                self.author.recipes_count, self.author.subscribers_count)
+
+    def test_orm_relations_update_counters(self):
+        self.assertEqual(self.counters(), (0, 0, 1, 0))
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        Subscribe.objects.create(user=self.user, author=self.author)
+        self.assertEqual(self.counters(), (1, 1, 1, 1))
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.filter(user=self.user).delete()
+            Subscribe.objects.filter(user=self.user).delete()
+        self.assertEqual(self.counters(), (0, 1, 1, 0))
+
+    def test_api_removes_relation_created_by_orm(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        for action in ('favorite', 'shopping_cart'):
+            response = self.client.delete(
+                f'/api/recipes/{self.recipe.pk}/{action}/')
+            self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters(), (0, 0, 1, 0))
+
+    def test_api_toggle_keeps_counters(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.counters(), (1, 0, 1, 0))
+        self.assertEqual(self.client.delete(url).status_code, 204)
+        self.assertEqual(self.counters(), (0, 0, 1, 0))
+
+    def test_decrement_does_not_go_below_zero(self):
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        Recipe.objects.filter(pk=self.recipe.pk).update(favorites_count=0)
+        response = self.client.delete(
+            f'/api/recipes/{self.recipe.pk}/favorite/')
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.counters()[0], 0)
+
+    def test_recipe_delete_updates_author_counter(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+    def test_cascade_recounts_each_counter_once(self):
+        for index in range(2, 7):
+            Favorite.objects.create(user=create_user(index),
+                                    recipe=self.recipe)
+        with CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            self.recipe.delete()
+        updates = [query['sql'] for query in queries.captured_queries
+                   if query['sql'].startswith('UPDATE')]
+        self.assertEqual(len(updates), 1)
+        self.assertIn('recipes_count', updates[0])
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.recipes_count, 0)
+
+
+class RankingScoresTest(APITestCase):
+
+    def setUp(self):
+        self.user = create_user(0)
+        self.recipe = Recipe.objects.create(
+            author=self.user, name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+        self.client.force_authenticate(self.user)
+
+    def scores(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.popular_score, self.recipe.trending_score
+
+    def test_toggle_does_not_inflate_scores(self):
+        for action in ('favorite', 'shopping_cart'):
+            url = f'/api/recipes/{self.recipe.pk}/{action}/'
+            for _ in range(5):
+                self.assertEqual(self.client.post(url).status_code, 201)
+                self.assertEqual(self.client.delete(url).status_code, 204)
+        popular, trending = self.scores()
+        self.assertAlmostEqual(popular, 0)
+        self.assertAlmostEqual(trending, 0)
+
+    def test_remove_subtracts_original_event_weight(self):
+        url = f'/api/recipes/{self.recipe.pk}/favorite/'
+        self.client.post(url)
+        self.client.post(f'/api/recipes/{self.recipe.pk}/shopping_cart/')
+        before = self.scores()
+        favorite = Favorite.objects.get(user=self.user)
+        expected = [
+            score - increment for score, increment in zip(
+                before, score_increments(Favorite,
+                                         favorite.created_at).values())
+        ]
+        self.client.delete(url)
+        for actual, value in zip(self.scores(), expected):
+            self.assertAlmostEqual(actual / value, 1)
+
+
+class RecipeIngredientIndexTest(APITestCase):
+
+    def setUp(self):
+        self.ingredient = Ingredient.objects.create(name='мука',
+                                                    measurement_unit='г')
+        self.recipe = Recipe.objects.create(
+            author=create_user(0), name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+        self.index = RecipeIngredientIndex()
+
+    def matched_ids(self):
+        matches = self.index.match([self.ingredient.pk])
+        return [item['id'] for item in matches[:len(matches)]]
+
+    def test_expired_index_is_rebuilt_in_background(self):
+        self.assertEqual(self.matched_ids(), [])
+        IngredientRecipe.objects.create(recipe=self.recipe,
+                                        ingredient=self.ingredient, amount=1)
+        self.assertEqual(self.matched_ids(), [])
+        expired = self.index.loaded_at + INDEX_TTL + 1
+        with mock.patch('api.matching.time.monotonic',
+                        return_value=expired), \
+                mock.patch.object(self.index,
+                                  'rebuild_in_background') as rebuild, \
+                self.assertNumQueries(0):
+            self.assertEqual(self.matched_ids(), [])
+        rebuild.assert_called_once_with()
+        self.index.rebuild()
+        self.assertEqual(self.matched_ids(), [self.recipe.pk])
+
+    def test_other_process_applies_published_changes(self):
+        other = RecipeIngredientIndex()
+        self.assertEqual(self.matched_ids(), [])
+        other.match([self.ingredient.pk])
+        other.apply(self.recipe.pk, [self.ingredient.pk])
+        with mock.patch.object(self.index,
+                               'rebuild_in_background') as rebuild, \
+                self.assertNumQueries(0):
+            self.assertEqual(self.matched_ids(), [self.recipe.pk])
+        rebuild.assert_not_called()
+
+    def test_lost_changes_trigger_background_rebuild(self):
+        self.assertEqual(self.matched_ids(), [])
+        self.index.reset()
+        with mock.patch.object(self.index,
+                               'rebuild_in_background') as rebuild:
+            self.matched_ids()
+        rebuild.assert_called_once_with()
+
+
+class RecipeIngredientSignalsTest(APITestCase):
+
+    def setUp(self):
+        self.ingredient = Ingredient.objects.create(name='корица',
+                                                    measurement_unit='г')
+        self.recipe = Recipe.objects.create(
+            author=create_user(0), name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+
+    def found(self):
+        return list(search_recipes(Recipe.objects.all(), 'корица'))
+
+    def test_admin_changes_refresh_index_and_search(self):
+        model_admin = IngredientRecipeAdmin(IngredientRecipe, admin.site)
+        recipe_index.match([self.ingredient.pk])
+        item = IngredientRecipe(recipe=self.recipe,
+                                ingredient=self.ingredient, amount=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.save_model(None, item, None, False)
+        matches = recipe_index.match([self.ingredient.pk])
+        self.assertEqual([match['id'] for match in matches[:1]],
+                         [self.recipe.pk])
+        self.assertEqual(self.found(), [self.recipe])
+        with self.captureOnCommitCallbacks(execute=True):
+            model_admin.delete_model(None, item)
+        self.assertEqual(len(recipe_index.match([self.ingredient.pk])), 0)
+        self.assertEqual(self.found(), [])
+
+    def test_ingredient_rows_are_deleted_in_one_query(self):
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=1)
+        with self.assertNumQueries(1):
+            IngredientRecipe.objects.filter(recipe=self.recipe).delete()
+
+    def test_recipe_delete_removes_search_row(self):
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.ingredient, amount=1)
+        recipe_id = self.recipe.pk
+        self.recipe.delete()
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT count(*) FROM recipes_recipe_fts '
+                               'WHERE rowid = %s', [recipe_id])
+                self.assertEqual(cursor.fetchone()[0], 0)
+
+
+class CursorPaginationTest(APITestCase):
+
+    def setUp(self):
+        author = create_user(0)
+        self.recipes = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {index}', text='Приготовить',
+                image='recipe_images/pie.png', cooking_time=cooking_time,
+                popular_score=score)
+            for index, (cooking_time, score) in enumerate(
+                [(30, 0.5), (5, 2.5), (30, 1e43), (1, 0.0), (5, 2.5)])
+        ]
+
+    def paged_ids(self, params):
+        ids = []
+        response = self.client.get('/api/recipes/', {**params, 'limit': 2})
+        while True:
+            self.assertEqual(response.status_code, 200)
+            ids.extend(recipe['id'] for recipe in response.data['results'])
+            if not response.data['next']:
+                return ids
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_keeps_requested_ordering(self):
+        for ordering, key in (
+                ('quickest', lambda recipe: (recipe.cooking_time,
+                                             -recipe.pk)),
+                ('popular', lambda recipe: (-recipe.popular_score,
+                                            -recipe.pk))):
+            expected = [recipe.pk for recipe in sorted(self.recipes,
+                                                       key=key)]
+            self.assertEqual(
+                self.paged_ids({'ordering': ordering,
+                                'pagination': 'cursor'}), expected)
+
+    def test_cursor_keeps_search_relevance(self):
+        for index, (name, text) in enumerate([
+                ('Сахар жженый', 'Растопить сахар'), ('Суп', 'Без сахара'),
+                ('Пирог', 'Сахар и мука'), ('Сахарный пирог', 'Испечь'),
+                ('Компот', 'Сахар')]):
+            Recipe.objects.create(
+                author=self.recipes[0].author, name=name, text=text,
+                image='recipe_images/pie.png', cooking_time=index + 1)
+        ranked = self.client.get('/api/recipes/',
+                                 {'search': 'сахар', 'limit': 10})
+        expected = [recipe['id'] for recipe in ranked.data['results']]
+        self.assertEqual(len(expected), 5)
+        self.assertNotEqual(expected, sorted(expected, reverse=True))
+        self.assertEqual(
+            self.paged_ids({'search': 'сахар', 'pagination': 'cursor'}),
+            expected)
+
+    def cursor(self, position):
+        return base64.b64encode(f'p={position}'.encode()).decode()
+
+    def test_non_numeric_position_returns_404(self):
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': self.cursor('abc')})
+        self.assertEqual(response.status_code, 404)
+
+    def test_numeric_position_is_accepted(self):
+        response = self.client.get('/api/recipes/',
+                                   {'cursor': self.cursor(10)})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(FEED_MERGE_AUTHORS=1)
+class FeedCacheTest(APITestCase):
+
+    def setUp(self):
+        self.user = create_user(0)
+        self.authors = [create_user(index) for index in (1, 2)]
+        for author in self.authors:
+            Subscribe.objects.create(user=self.user, author=author)
+            self.create_recipe(author)
+        self.client.force_authenticate(self.user)
+
+    def create_recipe(self, author):
+        return Recipe.objects.create(
+            author=author, name=f'Пирог {Recipe.objects.count()}',
+            text='Испечь', image='recipe_images/pie.png', cooking_time=40)
+
+    def feed_ids(self):
+        response = self.client.get('/api/recipes/feed/', {'limit': 10})
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_changes_from_other_process_reach_merged_feed(self):
+        self.assertEqual(len(self.feed_ids()), 2)
+        with mock.patch('api.signals.invalidate_author_feed'):
+            created = self.create_recipe(self.authors[0])
+        self.assertEqual(self.feed_ids()[0], created.pk)
+        with mock.patch('api.signals.invalidate_author_feed'), \
+                self.captureOnCommitCallbacks(execute=True):
+            created.delete()
+        self.assertEqual(len(self.feed_ids()), 2)
+
+
+class BenchmarkCommandTest(APITestCase):
+
+    def test_seed_refuses_non_sqlite_database(self):
+        with mock.patch.object(connection, 'vendor', 'postgresql'), \
+                self.assertRaises(CommandError):
+            call_command('benchmark', '--seed')
+        self.assertFalse(User.objects.exists())
+
+
+class UserListQueriesTest(APITestCase):
+
+    def test_subscription_flag_does_not_add_queries(self):
+        user = create_user(0)
+        for index in range(1, 13):
+            Subscribe.objects.create(user=user, author=create_user(index))
+        self.client.force_authenticate(user)
+        for limit in (3, 6):
+            with self.assertNumQueries(2):
+                response = self.client.get('/api/users/', {'limit': limit})
+            self.assertTrue(all(item['is_subscribed'] or item['id'] == user.id
+                                for item in response.data['results']))
+
+
+class RecipeQueriesTest(APITestCase):
+
+    def setUp(self):
+        self.user = create_user(0)
+        self.tags = [Tag.objects.create(name=f'Тег {index}',
+                                        color=f'#00000{index}',
+                                        slug=f'tag{index}')
+                     for index in range(2)]
+        ingredients = [Ingredient.objects.create(name=f'Ингредиент {index}',
+                                                 measurement_unit='г')
+                       for index in range(3)]
+        for index in range(1, 13):
+            recipe = Recipe.objects.create(
+                author=create_user(index), name=f'Рецепт {index}',
+                text='Приготовить', image='recipe_images/dish.png',
+                cooking_time=index)
+            recipe.tags.set(self.tags)
+            IngredientRecipe.objects.bulk_create(
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=index)
+                for ingredient in ingredients)
+            Favorite.objects.create(user=self.user, recipe=recipe)
+        self.recipe = recipe
+
+    def count_queries(self, url, params=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_list_queries_do_not_grow_with_page_size(self):
+        for authenticated in (False, True):
+            self.client.force_authenticate(self.user if authenticated
+                                           else None)
+            with self.subTest(authenticated=authenticated):
+                self.assertEqual(
+                    self.count_queries('/api/recipes/', {'limit': 3}),
+                    self.count_queries('/api/recipes/', {'limit': 12}))
+
+    def test_detail_queries(self):
+        url = f'/api/recipes/{self.recipe.id}/'
+        with self.assertNumQueries(3):
+            self.client.get(url)
+        self.client.force_authenticate(self.user)
+        with self.assertNumQueries(3):
+            response = self.client.get(url)
+        self.assertTrue(response.data['is_favorited'])
+
+
+class RecipeEtagTest(APITestCase):
+
+    def setUp(self):
+        self.user = create_user(0)
+        self.tag = Tag.objects.create(name='Завтрак', color='#E26C2D',
+                                      slug='breakfast')
+        self.ingredient = Ingredient.objects.create(name='Мука',
+                                                    measurement_unit='г')
+        self.recipe = Recipe.objects.create(
+            author=create_user(1), name='Блины', text='Испечь',
+            image='recipe_images/pancakes.png', cooking_time=30)
+        self.recipe.tags.add(self.tag)
+        IngredientRecipe.objects.create(recipe=self.recipe,
+                                        ingredient=self.ingredient, amount=200)
+        self.client.force_authenticate(self.user)
+        self.urls = ('/api/recipes/', f'/api/recipes/{self.recipe.id}/')
+
+    def etags(self):
+        return [self.client.get(url)['ETag'] for url in self.urls]
+
+    def test_unchanged_recipes_return_not_modified(self):
+        for url, etag in zip(self.urls, self.etags()):
+            with self.assertNumQueries(2 if url == self.urls[0] else 1):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+            self.assertFalse(response.content)
+
+    def test_etag_changes_on_favorite(self):
+        before = self.etags()
+        Favorite.objects.create(user=self.user, recipe=self.recipe)
+        after = self.etags()
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+    def test_etag_changes_on_tag_edit(self):
+        before = self.etags()
+        self.tag.name = 'Ужин'
+        self.tag.save()
+        after = self.etags()
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+    def test_etag_changes_on_ingredient_edit(self):
+        before = self.etags()
+        self.ingredient.measurement_unit = 'кг'
+        self.ingredient.save()
+        after = self.etags()
+        self.assertTrue(all(old != new for old, new in zip(before, after)))
+
+
+class RecipeUpdateTest(APITestCase):
+
+    def setUp(self):
+        self.author = create_user(0)
+        self.user = create_user(1)
+        self.tags = [Tag.objects.create(name=f'Тег {index}',
+                                        color=f'#00000{index}',
+                                        slug=f'tag{index}')
+                     for index in range(3)]
+        self.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {index}',
+                                      measurement_unit='г')
+            for index in range(3)]
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Суп', text='Сварить',
+            image='recipe_images/soup.png', cooking_time=60)
+        self.recipe.tags.set(self.tags[:2])
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=self.recipe, ingredient=ingredient,
+                             amount=100)
+            for ingredient in self.ingredients[:2])
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipe)
+        CartIngredient.objects.rebuild([self.user.id])
+
+    def update(self, tags, amounts):
+        data = {
+            'name': self.recipe.name, 'text': self.recipe.text,
+            'cooking_time': self.recipe.cooking_time, 'tags': tags,
+            'ingredients': [{'id': ingredient, 'amount': amount}
+                            for ingredient, amount in amounts.items()],
+        }
+        with CaptureQueriesContext(connection) as queries:
+            RecipeWtiteSerializer().update(
+                Recipe.objects.get(pk=self.recipe.pk), data)
+        return [query['sql'].split()[0] for query in queries
+                if not query['sql'].startswith(('SAVEPOINT', 'RELEASE'))]
+
+    def recipe_state(self):
+        return (
+            set(self.recipe.tags.all()),
+            dict(self.recipe.ingredients_recipe.values_list(
+                'ingredient_id', 'amount')),
+        )
+
+    def cart(self):
+        return dict(CartIngredient.objects.filter(user=self.user)
+                    .values_list('ingredient_id', 'total_amount'))
+
+    def test_unchanged_payload_does_not_write(self):
+        statements = self.update(
+            self.tags[:2], {ingredient: 100
+                            for ingredient in self.ingredients[:2]})
+        self.assertEqual(set(statements), {'SELECT'})
+
+    def test_changed_amounts_use_bulk_update(self):
+        first, second = self.ingredients[:2]
+        with mock.patch.object(IngredientRecipe.objects, 'bulk_update',
+                               wraps=IngredientRecipe.objects.bulk_update
+                               ) as bulk_update:
+            self.update(self.tags[:2], {first: 150, second: 50})
+        bulk_update.assert_called_once()
+        self.assertEqual(len(bulk_update.call_args[0][0]), 2)
+        self.assertEqual(self.recipe_state()[1],
+                         {first.id: 150, second.id: 50})
+
+    def test_added_and_removed_items_are_applied(self):
+        first, _, third = self.ingredients
+        self.update(self.tags[1:], {first: 100, third: 30})
+        self.assertEqual(self.recipe_state(), (
+            set(self.tags[1:]), {first.id: 100, third.id: 30}))
+
+    def test_cart_receives_ingredient_deltas(self):
+        first, _, third = self.ingredients
+        self.update(self.tags[:2], {first: 120, third: 30})
+        self.assertEqual(self.cart(), {first.id: 120, third.id: 30})
+        self.assertEqual(self.cart(), {
+            ingredient_id: total for _, ingredient_id, total
+            in CartIngredient.objects.expected_totals([self.user.id])})
+
+
+class RecipeValidationTest(APITestCase):
+
+    def setUp(self):
+        self.tag = Tag.objects.create(name='Обед', color='#49B64E',
+                                      slug='lunch')
+        self.ingredient = Ingredient.objects.create(name='Рис',
+                                                    measurement_unit='г')
+
+    def attrs(self, tags, ingredient_ids):
+        return {'tags': tags, 'cooking_time': 20,
+                'ingredients': [{'id': pk, 'amount': 10}
+                                for pk in ingredient_ids]}
+
+    def test_objects_are_resolved_in_two_queries(self):
+        with self.assertNumQueries(2):
+            attrs = RecipeWtiteSerializer().validate(
+                self.attrs([self.tag.id], [self.ingredient.id]))
+        self.assertEqual(attrs['tags'], [self.tag])
+        self.assertEqual(attrs['ingredients'][0]['id'], self.ingredient)
+
+    def test_missing_tags_and_ingredients_are_reported_together(self):
+        with self.assertRaises(ValidationError) as context:
+            RecipeWtiteSerializer().validate(
+                self.attrs([self.tag.id, 999], [self.ingredient.id, 998]))
+        self.assertEqual(set(context.exception.detail),
+                         {'tags', 'ingredients'})
+        self.assertIn('999', str(context.exception.detail['tags']))
+        self.assertIn('998', str(context.exception.detail['ingredients']))
+
+
+class ShoppingCartDownloadTest(APITestCase):
+
+    def setUp(self):
+        self.user = create_user(0)
+        recipe = Recipe.objects.create(
+            author=self.user, name='Омлет', text='Пожарить',
+            image='recipe_images/omelette.png', cooking_time=10)
+        IngredientRecipe.objects.create(
+            recipe=recipe, amount=3,
+            ingredient=Ingredient.objects.create(name='Яйца',
+                                                 measurement_unit='шт'))
+        ShoppingCart.objects.create(user=self.user, recipe=recipe)
+        CartIngredient.objects.rebuild([self.user.id])
+        self.client.force_authenticate(self.user)
+
+    def download(self, export_format):
+        return self.client.get('/api/recipes/download_shopping_cart/',
+                               {'format': export_format})
+
+    def test_unknown_format_lists_supported_ones(self):
+        response = self.download('xls')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('txt, csv, pdf', response.content.decode())
+
+    def test_pdf_font_is_registered_once(self):
+        with mock.patch('api.utils.pdfmetrics.registerFont',
+                        wraps=pdfmetrics.registerFont) as register:
+            for _ in range(2):
+                response = self.download('pdf')
+                self.assertEqual(response.status_code, 200)
+                b''.join(response.streaming_content)
+        registered = [font.fontName for (font,), _ in register.call_args_list]
+        self.assertLessEqual(registered.count(PDF_FONT_NAME), 1)
+
+
+class SimilarRecipesTest(APITestCase):
+
+    def setUp(self):
+        author = create_user(0)
+        self.recipe, *others = [
+            Recipe.objects.create(
+                author=author, name=f'Салат {index}', text='Нарезать',
+                image='recipe_images/salad.png', cooking_time=10)
+            for index in range(3)]
+        SimilarRecipe.objects.bulk_create(
+            SimilarRecipe(recipe=self.recipe, similar=other, score=score)
+            for other, score in zip(others, (0.9, 0.5)))
+        self.url = f'/api/recipes/{self.recipe.id}/similar/'
+
+    def test_image_urls_are_absolute(self):
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data), 2)
+        for item in response.data:
+            self.assertTrue(item['image'].startswith('http://testserver/'))
+
+    def test_zero_limit_returns_empty_list(self):
+        response = self.client.get(self.url, {'recipes_limit': 0})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, [])
+
+
+class MetricsTest(APITestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(METRICS_DIR=directory.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.directory = directory.name
+
+    def write_dead_worker(self):
+        process = subprocess.Popen(['true'])
+        process.wait()
+        path = os.path.join(self.directory, f'{process.pid}.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump({
+                'counters': [
+                    ['foodgram_requests_total', {'view': 'v'}, 5],
+                    ['foodgram_worker_requests_total',
+                     {'pid': str(process.pid)}, 5],
+                ],
+                'histograms': [['foodgram_request_duration_seconds',
+                                {'view': 'v'},
+                                {'buckets': [1] * 11, 'sum': 2.0,
+                                 'count': 11}]],
+            }, file)
+        stale = time.time() - 3600
+        os.utime(path, (stale, stale))
+        return path
+
+    def test_dead_worker_file_is_folded_once(self):
+        path = self.write_dead_worker()
+        metrics = MetricsStore()
+        metrics.inc('foodgram_requests_total', {'view': 'v'}, 2)
+        for _ in range(2):
+            snapshots, alive = metrics.read_all()
+            counters, histograms = merge(snapshots, alive)
+            self.assertEqual(counters[('foodgram_requests_total',
+                                       '{view="v"}')], 7)
+            self.assertEqual(histograms[(
+                'foodgram_request_duration_seconds', '{view="v"}'
+            )]['count'], 11)
+        self.assertFalse(os.path.exists(path))
+        self.assertEqual(os.listdir(self.directory), [f'{os.getpid()}.json'])
+
+    def test_access_requires_allowed_address_or_token(self):
+        with override_settings(METRICS_ALLOWED_IPS=['10.1.0.0/16'],
+                               METRICS_TOKEN='secret'):
+            for remote_addr, headers, status_code in (
+                    ('127.0.0.1', {}, 403),
+                    ('10.1.2.3', {}, 200),
+                    ('127.0.0.1', {'HTTP_AUTHORIZATION': 'Bearer wrong'},
+                     403),
+                    ('127.0.0.1', {'HTTP_AUTHORIZATION': 'Bearer secret'},
+                     200)):
+                response = self.client.get('/api/metrics',
+                                           REMOTE_ADDR=remote_addr, **headers)
+                self.assertEqual(response.status_code, status_code)
@@ -1,5 +1,5 @@
 from api.views import (CustomUserViewSet, IngredientViewSet, RecipeViewSet,
-                       TagViewSet)
+                       TagViewSet, metrics)
 from django.urls import include, path
 from rest_framework import routers
 
@@ -11,5 +11,6 @@ router_v1.register('recipes', RecipeViewSet, basename='recipes')
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
+    path('metrics', metrics, name='metrics'),
     path('', include(router_v1.urls)),
 ]
@@ -1,16 +1,260 @@
+import base64
+import csv
+import hashlib
+import io
+import math
+import re
+import tempfile
 
-from django.db.models import Sum
-from recipes.models import IngredientRecipe
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from recipes.models import CartIngredient, IngredientRecipe
+from recipes.ranking import EPOCH
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFont
+from reportlab.pdfgen import canvas
 
+CHUNK_SIZE = 500
+BASE64_CHUNK_SIZE = 64 * 1024
+SPOOL_SIZE = 1024 * 1024
+WHITESPACE = re.compile(r'\s+')
 
-def get_ingredients_in_cart(user):
-    cart = IngredientRecipe.objects.filter(
-        recipe__cart__user=user).values_list(
+INSERT_RELATION_SQL = (
+    'INSERT INTO {table} ({user}, {target}{columns}) '
+    'SELECT %s, id{values} FROM {target_table} WHERE id = %s '
+    'ON CONFLICT DO NOTHING'
+)
+DELETE_RELATION_SQL = 'DELETE FROM {table} WHERE {user} = %s AND {target} = %s'
+# Счетчик не опускается ниже нуля, даже если разошелся с таблицей связей.
+CHANGED_COUNTER_SQL = {
+    True: '{counter} + 1',
+    False: 'CASE WHEN {counter} > 0 THEN {counter} - 1 ELSE 0 END',
+}
+UPDATE_COUNTER_SQL = (
+    'UPDATE {target_table} SET {counter} = {changed}{increments} '
+    'WHERE id = %s'
+)
+CHANGE_WITH_COUNTER_SQL = (
+    'WITH changed AS ({change} RETURNING {target}{returning}) '
+    'UPDATE {target_table} SET {counter} = {changed}{increments} '
+    'FROM changed WHERE {target_table}.id = changed.{target}'
+)
+# Вклад события в затухающую оценку: weight * exp((created_at - EPOCH) * rate).
+ADD_SCORE_SQL = '{column} = {column} + %s'
+SUBTRACT_SCORE_SQL = (
+    '{column} = CASE WHEN {column} > %s THEN {column} - %s ELSE 0 END'
+)
+SUBTRACT_EVENT_SCORE_SQL = (
+    '{column} = GREATEST({column} - %s * exp(('
+    'extract(epoch FROM changed.created_at) - %s) * %s), 0)'
+)
+ADD_CART_TOTALS_SQL = (
+    'INSERT INTO {totals} (user_id, ingredient_id, total_amount) '
+    'SELECT %s, ingredient_id, amount FROM {items} WHERE recipe_id = %s '
+    'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+    'SET total_amount = {totals}.total_amount + excluded.total_amount'
+)
+RECIPE_AMOUNT_SQL = (
+    '(SELECT amount FROM {items} '
+    'WHERE recipe_id = %s AND ingredient_id = {totals}.ingredient_id)'
+)
+SUBTRACT_CART_TOTALS_SQL = (
+    'UPDATE {totals} SET total_amount = CASE '
+    'WHEN total_amount > {amount} THEN total_amount - {amount} ELSE 0 END '
+    'WHERE user_id = %s AND ingredient_id IN '
+    '(SELECT ingredient_id FROM {items} WHERE recipe_id = %s)'
+)
+DELETE_EMPTY_CART_TOTALS_SQL = (
+    'DELETE FROM {totals} WHERE user_id = %s AND total_amount = 0'
+)
+PDF_FONT_NAME = 'ShoppingCartFont'
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 20
+
+
+def decode_base64(encoded):
+    """Декодирует base64 по частям во временный файл."""
+    if WHITESPACE.search(encoded):
+        encoded = WHITESPACE.sub('', encoded)
+    file = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    for start in range(0, len(encoded), BASE64_CHUNK_SIZE):
+        file.write(base64.b64decode(
+            encoded[start:start + BASE64_CHUNK_SIZE], validate=True))
+    file.seek(0)
+    return file
+
+
+def get_recipes_limit(request):
+    recipes_limit = request.query_params.get('recipes_limit')
+    if recipes_limit and recipes_limit.isdigit():
+        return int(recipes_limit)
+    return None
+
+
+def score_changes(scores, add, created_at):
+    """SQL и параметры изменения затухающих оценок на одно событие.
+
+    Без created_at вклад удаляемого события считается в самом запросе
+    по дате из удаленной строки (только PostgreSQL).
+    """
+    quote = connection.ops.quote_name
+    changes = []
+    params = []
+    for column, (weight, rate) in scores.items():
+        column = quote(column)
+        if created_at is None:
+            changes.append(SUBTRACT_EVENT_SCORE_SQL.format(column=column))
+            params.extend([weight, EPOCH.timestamp(), rate])
+            continue
+        value = weight * math.exp((created_at - EPOCH).total_seconds()
+                                  * rate)
+        if add:
+            changes.append(ADD_SCORE_SQL.format(column=column))
+            params.append(value)
+        else:
+            changes.append(SUBTRACT_SCORE_SQL.format(column=column))
+            params.extend([value, value])
+    return ''.join(f', {change}' for change in changes), params
+
+
+def change_relation(model, field, counter, user, target_id, add,
+                    scores=None):
+    """Добавляет или удаляет связь пользователя одним запросом.
+
+    scores: затухающие оценки целевой таблицы, которые меняет связь,
+    {колонка: (вес, скорость роста)} из recipes.ranking.score_terms.
+    Такая связь хранит дату события в created_at, и при удалении
+    вычитается вклад события с его исходной датой.
+    Возвращает False, если связь уже была (или отсутствовала).
+    """
+    quote = connection.ops.quote_name
+    target_field = model._meta.get_field(field)
+    postgresql = connection.vendor == 'postgresql'
+    params = [user.pk, int(target_id)]
+    created_at = None
+    if scores and add:
+        created_at = timezone.now()
+        params.insert(1, created_at)
+    elif scores and not postgresql:
+        created_at = model.objects.filter(
+            user=user, **{field: int(target_id)}
+        ).values_list('created_at', flat=True).first()
+        if created_at is None:
+            return False
+    increments, score_params = score_changes(scores or {}, add, created_at)
+    names = {
+        'table': quote(model._meta.db_table),
+        'user': quote(model._meta.get_field('user').column),
+        'target': quote(target_field.column),
+        'target_table': quote(target_field.related_model._meta.db_table),
+        'counter': quote(counter),
+        'changed': CHANGED_COUNTER_SQL[add].format(counter=quote(counter)),
+        'columns': ', created_at' if scores and add else '',
+        'values': ', %s' if scores and add else '',
+        'returning': ', created_at' if scores and not add else '',
+        'increments': increments,
+    }
+    change = (INSERT_RELATION_SQL if add else DELETE_RELATION_SQL).format(
+        **names)
+    if postgresql:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                CHANGE_WITH_COUNTER_SQL.format(change=change, **names),
+                params + score_params)
+            return cursor.rowcount > 0
+    with transaction.atomic(savepoint=False), connection.cursor() as cursor:
+        cursor.execute(change, params)
+        if not cursor.rowcount:
+            return False
+        cursor.execute(UPDATE_COUNTER_SQL.format(**names),
+                       [*score_params, int(target_id)])
+        return True
+
+
+def change_cart_totals(user, recipe_id, add):
+    """Прибавляет или вычитает ингредиенты рецепта из итогов корзины."""
+    quote = connection.ops.quote_name
+    names = {
+        'totals': quote(CartIngredient._meta.db_table),
+        'items': quote(IngredientRecipe._meta.db_table),
+    }
+    recipe_id = int(recipe_id)
+    with connection.cursor() as cursor:
+        if add:
+            cursor.execute(ADD_CART_TOTALS_SQL.format(**names),
+                           [user.pk, recipe_id])
+            return
+        amount = RECIPE_AMOUNT_SQL.format(**names)
+        cursor.execute(
+            SUBTRACT_CART_TOTALS_SQL.format(amount=amount, **names),
+            [recipe_id, recipe_id, user.pk, recipe_id])
+        cursor.execute(DELETE_EMPTY_CART_TOTALS_SQL.format(**names),
+                       [user.pk])
+
+
+def get_recipes_etag(recipes, *extra):
+    state = [
+        (recipe.pk, recipe.updated_at.isoformat(), recipe.is_favorited,
+         recipe.is_in_shopping_cart, recipe.author_is_subscribed)
+        for recipe in recipes
+    ]
+    digest = hashlib.md5(repr((state, extra)).encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def ingredients_in_cart(user):
+    return CartIngredient.objects.filter(user=user).values_list(
         'ingredient__name',
-        'ingredient__measurement_unit'
-    ).annotate(sum_amount=Sum('amount'))
-    ingredient_list = []
-    for ingredient in cart:
-        name, unit, amount = ingredient
-        ingredient_list.append(f'{name} {amount} {unit}\n')
-    return ingredient_list
+        'ingredient__measurement_unit',
+        'total_amount',
+    ).order_by('ingredient__name')
+
+
+def get_ingredients_in_cart(user):
+    return ingredients_in_cart(user).iterator(chunk_size=CHUNK_SIZE)
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def shopping_cart_txt(ingredients):
+    for name, unit, amount in ingredients:
+        yield f'{name} {amount} {unit}\n'
+
+
+def shopping_cart_csv(ingredients):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(
+        ('Ингредиент', 'Количество', 'Единица измерения'))
+    for name, unit, amount in ingredients:
+        yield writer.writerow((name, amount, unit))
+
+
+def register_pdf_font():
+    if PDF_FONT_NAME not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont(PDF_FONT_NAME, settings.PDF_FONT))
+
+
+def shopping_cart_pdf(ingredients):
+    register_pdf_font()
+    buffer = io.BytesIO()
+    page = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    y = height - PDF_MARGIN
+    page.setFont(PDF_FONT_NAME, 16)
+    page.drawString(PDF_MARGIN, y, 'Список покупок')
+    page.setFont(PDF_FONT_NAME, 12)
+    for name, unit, amount in ingredients:
+        y -= PDF_LINE_HEIGHT
+        if y < PDF_MARGIN:
+            page.showPage()
+            page.setFont(PDF_FONT_NAME, 12)
+            y = height - PDF_MARGIN
+        page.drawString(PDF_MARGIN, y, f'• {name} — {amount} {unit}')
+    page.save()
+    buffer.seek(0)
+    return buffer
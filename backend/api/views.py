@@ -1,17 +1,34 @@
+from api.cache import CachedCatalogMixin
+from api.feed import merge_feed_ids
 from api.filters import IngredientFilter, RecipeFilter
-from api.paginations import LimitPagination
+from api.matching import recipe_index
+from api.metrics import CONTENT_TYPE, is_allowed, render_metrics
+from api.paginations import CursorLimitPagination, LimitPagination
 from api.permissions import IsAuthorOrReadOnly
+from api.renderers import (ShoppingCartCSVRenderer, ShoppingCartNegotiation,
+                           ShoppingCartPDFRenderer, ShoppingCartTextRenderer)
 from api.serializers import (CustomUserSerializer, IngredientSerializer,
-                             RecipeReadSerializer, RecipeReadShortSerializer,
-                             RecipeWtiteSerializer, SubscribeSerializer,
-                             TagSerializer)
-from api.utils import get_ingredients_in_cart
+                             RecipeMatchSerializer, RecipeReadSerializer,
+                             RecipeReadShortSerializer, RecipeWtiteSerializer,
+                             SubscribeSerializer, TagSerializer)
+from api.utils import (change_cart_totals, change_relation,
+                       get_ingredients_in_cart, get_recipes_etag,
+                       get_recipes_limit, shopping_cart_csv, shopping_cart_pdf,
+                       shopping_cart_txt)
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.http import HttpResponse
+from django.db import transaction
+from django.db.models import (BooleanField, Exists, OuterRef, Prefetch,
+                              Subquery, Value, prefetch_related_objects)
+from django.http import (FileResponse, HttpResponse, HttpResponseForbidden,
+                         StreamingHttpResponse)
 from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_vary_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from recipes.models import (CartIngredient, Favorite, Ingredient, Recipe,
+                            RecipeQuerySet, ShoppingCart, Tag)
+from recipes.ranking import score_terms
 from rest_framework import permissions, status
 from rest_framework.decorators import action
 from rest_framework.permissions import AllowAny, IsAuthenticated
@@ -21,11 +38,24 @@ from users.models import Subscribe
 
 User = get_user_model()
 
+SIMILAR_LIMIT = 6
+
 
 class CustomUserViewSet(UserViewSet):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
     permission_classes = [AllowAny]
+    pagination_class = LimitPagination
+    lookup_value_regex = r'\d+'
+
+    def get_queryset(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return super().get_queryset().annotate(
+                is_subscribed=Value(False, output_field=BooleanField()))
+        return super().get_queryset().annotate(
+            is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('pk'))))
 
     @action(
         detail=False,
@@ -33,8 +63,20 @@ class CustomUserViewSet(UserViewSet):
         permission_classes=[IsAuthenticated]
     )
     def subscriptions(self, request):
-        user = request.user
-        subscriptions = User.objects.filter(subscribing__user=user)
+        recipes = Recipe.objects.all()
+        recipes_limit = get_recipes_limit(request)
+        if recipes_limit is not None:
+            recipes = recipes.filter(pk__in=Subquery(
+                Recipe.objects.filter(author=OuterRef('author'))
+                .values('pk')[:recipes_limit]
+            ))
+        subscriptions = User.objects.filter(
+            subscribing__user=request.user
+        ).annotate(
+            is_subscribed=Value(True, output_field=BooleanField()),
+        ).order_by('id').prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+        )
         page = self.paginate_queryset(subscriptions)
         serializer = SubscribeSerializer(page, many=True,
                                          context={'request': request})
@@ -47,28 +89,28 @@ class CustomUserViewSet(UserViewSet):
     )
     def subscribe(self, request, id=None):
         user = request.user
-        author = get_object_or_404(User, id=id)
         if request.method == 'POST':
+            author = get_object_or_404(User, id=id)
             serializer = SubscribeSerializer(author,
                                              data=request.data,
                                              context={'request': request})
-            if serializer.is_valid(raise_exception=True):
-                Subscribe.objects.create(user=user, author=author)
-            return Response(serializer.data)
-
-        if request.method == 'DELETE':
-            if not Subscribe.objects.filter(user=user, author=author).exists():
-                return Response('Вы не были на него подписаны',
+            serializer.is_valid(raise_exception=True)
+            if not change_relation(Subscribe, 'author', 'subscribers_count',
+                                   user, author.pk, add=True):
+                return Response('Вы уже подписаны на этого пользователя',
                                 status=status.HTTP_400_BAD_REQUEST)
-            subscriptions = get_object_or_404(Subscribe,
-                                              user=user,
-                                              author=author)
+            return Response(serializer.data)
 
-            subscriptions.delete()
+        if not change_relation(Subscribe, 'author', 'subscribers_count',
+                               user, id, add=False):
+            get_object_or_404(User, id=id)
+            return Response('Вы не были на него подписаны',
+                            status=status.HTTP_400_BAD_REQUEST)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(CachedCatalogMixin, ReadOnlyModelViewSet):
+    catalog_name = 'ingredients'
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
@@ -76,41 +118,94 @@ class IngredientViewSet(ReadOnlyModelViewSet):
     pagination_class = None
 
 
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(CachedCatalogMixin, ReadOnlyModelViewSet):
+    catalog_name = 'tags'
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
 class RecipeViewSet(ModelViewSet):
-    queryset = Recipe.objects.all()
     permission_classes = [IsAuthorOrReadOnly]
+    lookup_value_regex = r'\d+'
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     pagination_class = LimitPagination
 
+    def get_queryset(self):
+        return Recipe.objects.select_related('author').with_user_flags(
+            self.request.user)
+
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator') and (
+                self.action == 'feed' or self.action == 'list'
+                and CursorLimitPagination.is_requested(self.request)):
+            self._paginator = CursorLimitPagination()
+        return super().paginator
+
+    def conditional_response(self, recipes, etag, render):
+        response = get_conditional_response(self.request, etag=etag)
+        if response is None:
+            prefetch_related_objects(recipes,
+                                     *RecipeQuerySet.related_lookups())
+            response = render()
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        extra = [request.get_full_path()]
+        if isinstance(self.paginator, LimitPagination):
+            extra.append(self.paginator.page.paginator.count)
+        etag = get_recipes_etag(page, *extra)
+        return self.conditional_response(
+            page, etag,
+            lambda: self.get_paginated_response(
+                self.get_serializer(page, many=True).data)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        etag = get_recipes_etag([instance])
+        return self.conditional_response(
+            [instance], etag,
+            lambda: Response(self.get_serializer(instance).data)
+        )
+
     def get_serializer_class(self):
         if self.request.method in permissions.SAFE_METHODS:
             return RecipeReadSerializer
         return RecipeWtiteSerializer
 
+    @transaction.atomic
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    def add_recipe(self, user, model, pk):
-        if model.objects.filter(user=user, recipe__id=pk).exists():
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        cart_users = list(instance.cart.values_list('user_id', flat=True))
+        if cart_users:
+            CartIngredient.objects.apply_deltas(cart_users, {
+                item.ingredient_id: -item.amount
+                for item in instance.ingredients_recipe.all()
+            })
+        instance.delete()
+
+    def add_recipe(self, user, model, pk, counter):
+        recipe = get_object_or_404(Recipe, id=pk)
+        if not change_relation(model, 'recipe', counter, user, recipe.pk,
+                               add=True, scores=score_terms(model)):
             return Response('Рецепт уже был добавлен',
                             status=status.HTTP_400_BAD_REQUEST)
-        recipe = get_object_or_404(Recipe, id=pk)
-        model.objects.create(user=user, recipe=recipe)
         serializer = RecipeReadShortSerializer(recipe)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
-    def delete_recipe(self, user, model, pk):
-        recipe = model.objects.filter(user=user,
-                                      recipe__id=pk)
-        if recipe.exists():
-            recipe.delete()
+    def delete_recipe(self, user, model, pk, counter):
+        if change_relation(model, 'recipe', counter, user, pk, add=False,
+                           scores=score_terms(model)):
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(
             'Вы пытаетесь удалить рецепт, который уже был удален',
@@ -120,10 +215,18 @@ class RecipeViewSet(ModelViewSet):
             methods=['POST', 'DELETE'],
             permission_classes=[IsAuthenticated]
             )
+    @transaction.atomic
     def shopping_cart(self, request, pk):
-        if request.method == 'POST':
-            return self.add_recipe(request.user, ShoppingCart, pk)
-        return self.delete_recipe(request.user, ShoppingCart, pk)
+        add = request.method == 'POST'
+        if add:
+            response = self.add_recipe(request.user, ShoppingCart, pk,
+                                       'cart_count')
+        else:
+            response = self.delete_recipe(request.user, ShoppingCart, pk,
+                                          'cart_count')
+        if response.status_code < status.HTTP_400_BAD_REQUEST:
+            change_cart_totals(request.user, pk, add)
+        return response
 
     @action(detail=True,
             methods=['POST', 'DELETE'],
@@ -131,18 +234,116 @@ class RecipeViewSet(ModelViewSet):
             )
     def favorite(self, request, pk):
         if request.method == 'POST':
-            return self.add_recipe(request.user, Favorite, pk)
-        return self.delete_recipe(request.user, Favorite, pk)
+            return self.add_recipe(request.user, Favorite, pk,
+                                   'favorites_count')
+        return self.delete_recipe(request.user, Favorite, pk,
+                                  'favorites_count')
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def feed(self, request):
+        author_ids = list(Subscribe.objects.filter(
+            user=request.user).values_list('author_id', flat=True))
+        queryset = self.get_queryset()
+        if len(author_ids) > settings.FEED_MERGE_AUTHORS:
+            recipe_ids = merge_feed_ids(
+                author_ids, self.paginator.decode_cursor(request),
+                self.paginator.get_page_size(request))
+            queryset = queryset.filter(id__in=recipe_ids)
+        else:
+            queryset = queryset.filter(author_id__in=author_ids)
+        page = self.paginate_queryset(queryset)
+        prefetch_related_objects(page, *RecipeQuerySet.related_lookups())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def similar(self, request, pk):
+        limit = get_recipes_limit(request)
+        if limit is None:
+            limit = SIMILAR_LIMIT
+        recipes = list(Recipe.objects.filter(
+            similar_for__recipe_id=pk
+        ).order_by('-similar_for__score')[:limit])
+        if not recipes:
+            get_object_or_404(Recipe, id=pk)
+        serializer = RecipeReadShortSerializer(recipes, many=True,
+                                               context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=False, permission_classes=[IsAuthenticated])
+    def recommended(self, request):
+        queryset = self.get_queryset().filter(
+            recommended_for__user=request.user
+        ).order_by('-recommended_for__score', '-id')
+        page = self.paginate_queryset(queryset)
+        prefetch_related_objects(page, *RecipeQuerySet.related_lookups())
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def what_to_cook(self, request):
+        try:
+            ingredient_ids = {
+                int(value)
+                for param in request.query_params.getlist('ingredients')
+                for value in param.split(',') if value.strip()
+            }
+            max_missing = request.query_params.get('max_missing')
+            if max_missing is not None:
+                max_missing = int(max_missing)
+        except ValueError:
+            return Response('Некорректные параметры подбора',
+                            status=status.HTTP_400_BAD_REQUEST)
+        if not ingredient_ids:
+            return Response('Укажите хотя бы один ингредиент',
+                            status=status.HTTP_400_BAD_REQUEST)
+        page = self.paginate_queryset(
+            recipe_index.match(ingredient_ids, max_missing))
+        recipes = self.get_queryset().in_bulk(
+            [item['id'] for item in page])
+        matched = []
+        for item in page:
+            recipe = recipes.get(item['id'])
+            if recipe is not None:
+                recipe.coverage = round(item['coverage'], 3)
+                recipe.missing = item['missing']
+                matched.append(recipe)
+        prefetch_related_objects(matched, *RecipeQuerySet.related_lookups())
+        serializer = RecipeMatchSerializer(matched, many=True,
+                                           context={'request': request})
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=False,
-            permission_classes=[IsAuthenticated]
+            permission_classes=[IsAuthenticated],
+            renderer_classes=[ShoppingCartTextRenderer,
+                              ShoppingCartCSVRenderer,
+                              ShoppingCartPDFRenderer],
+            content_negotiation_class=ShoppingCartNegotiation
             )
     def download_shopping_cart(self, request):
-        ingredients_in_cart = get_ingredients_in_cart(request.user)
-        if not ingredients_in_cart:
+        if not ShoppingCart.objects.filter(user=request.user).exists():
             return Response('Нечего скачивать, корзина пуста',
-                            status=status.HTTP_400_BAD_REQUEST)
-        response = HttpResponse(ingredients_in_cart, content_type='text/plain')
-        response['Content-Disposition'] = ('attachment;'
-                                           + 'filename="shopping_cart.txt"')
+                            status=status.HTTP_400_BAD_REQUEST,
+                            content_type='text/plain; charset=utf-8')
+        export_format = request.accepted_renderer.format
+        filename = f'shopping_cart.{export_format}'
+        ingredients = get_ingredients_in_cart(request.user)
+        if export_format == 'pdf':
+            return FileResponse(shopping_cart_pdf(ingredients),
+                                as_attachment=True, filename=filename)
+        if export_format == 'csv':
+            content = shopping_cart_csv(ingredients)
+        else:
+            content = shopping_cart_txt(ingredients)
+        response = StreamingHttpResponse(
+            content,
+            content_type=f'{request.accepted_renderer.media_type}; '
+                         f'charset={request.accepted_renderer.charset}')
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
         return response
+
+
+def metrics(request):
+    if not is_allowed(request):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type=CONTENT_TYPE)
@@ -1,7 +1,13 @@
 from django.contrib import admin
 
-from .models import (Favorite, Ingredient, IngredientRecipe, Recipe,
-                     ShoppingCart, Tag)
+from .models import (CartIngredient, Favorite, Ingredient, IngredientRecipe,
+                     Recipe, ShoppingCart, Tag)
+from .signals import recipe_ingredients_changed
+
+
+def cart_users(recipe_ids):
+    return list(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids).values_list('user_id', flat=True))
 
 
 @admin.register(Ingredient)
@@ -24,24 +30,73 @@ class IngredientRecipeInline(admin.TabularInline):
 
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'author',)
+    list_display = ('id', 'name', 'author', 'favorites_count')
     list_filter = ('author', 'name', 'tags')
-    readonly_fields = ['added_to_favorites']
+    readonly_fields = ['favorites_count', 'cart_count']
     inlines = [IngredientRecipeInline]
 
-    def added_to_favorites(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        recipe_ingredients_changed.send(sender=Recipe,
+                                        recipe_ids=[form.instance.pk])
+        if change:
+            CartIngredient.objects.rebuild(cart_users([form.instance.pk]))
+
+    def delete_model(self, request, obj):
+        user_ids = cart_users([obj.pk])
+        super().delete_model(request, obj)
+        CartIngredient.objects.rebuild(user_ids)
+
+    def delete_queryset(self, request, queryset):
+        user_ids = cart_users(queryset.values('pk'))
+        super().delete_queryset(request, queryset)
+        CartIngredient.objects.rebuild(user_ids)
 
 
 @admin.register(IngredientRecipe)
 class IngredientRecipeAdmin(admin.ModelAdmin):
     list_display = ('recipe', 'ingredient', 'amount')
 
+    def save_model(self, request, obj, form, change):
+        previous = (IngredientRecipe.objects.filter(pk=obj.pk)
+                    .values_list('recipe_id', flat=True).first())
+        super().save_model(request, obj, form, change)
+        self.recipes_changed({obj.recipe_id, previous} - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        self.recipes_changed([obj.recipe_id])
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = set(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        self.recipes_changed(recipe_ids)
+
+    def recipes_changed(self, recipe_ids):
+        Recipe.objects.filter(pk__in=recipe_ids).touch()
+        recipe_ingredients_changed.send(sender=Recipe, recipe_ids=recipe_ids)
+        CartIngredient.objects.rebuild(cart_users(recipe_ids))
+
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
     list_display = ('user', 'recipe')
 
+    def save_model(self, request, obj, form, change):
+        previous = (ShoppingCart.objects.filter(pk=obj.pk)
+                    .values_list('user_id', flat=True).first())
+        super().save_model(request, obj, form, change)
+        CartIngredient.objects.rebuild({obj.user_id, previous} - {None})
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        CartIngredient.objects.rebuild([obj.user_id])
+
+    def delete_queryset(self, request, queryset):
+        user_ids = list(queryset.values_list('user_id', flat=True))
+        super().delete_queryset(request, queryset)
+        CartIngredient.objects.rebuild(user_ids)
+
 
 @admin.register(Favorite)
 class FavoriteAdmin(admin.ModelAdmin):
@@ -0,0 +1,31 @@
+from django.contrib.auth import get_user_model
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from users.models import Subscribe
+
+from .models import Favorite, Recipe, ShoppingCart
+
+User = get_user_model()
+
+# (модель со счетчиком, счетчик, модель связи, поле связи)
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'cart_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Subscribe, 'author'),
+)
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(**{field: OuterRef('pk')}).order_by()
+        .values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
+
+
+def recount(source, field, target_ids):
+    """Пересчитывает счетчики связей source для заданных объектов."""
+    for target, counter, model, model_field in COUNTERS:
+        if model is source and model_field == field:
+            target.objects.filter(pk__in=target_ids).update(
+                **{counter: count_of(model, field)})
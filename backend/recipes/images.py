@@ -0,0 +1,94 @@
+import base64
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection, transaction
+from django.utils import timezone
+from PIL import Image, ImageFilter
+from recipes.models import Recipe
+
+logger = logging.getLogger(__name__)
+
+THUMBNAIL_WIDTHS = {'small': 320, 'medium': 640}
+THUMBNAIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+# Заглушка встраивается в ответ как data URI: около 0,9 КБ на рецепт,
+# в том числе в каждом элементе списка рецептов.
+PLACEHOLDER_SIZE = (16, 16)
+
+executor = (ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS,
+                               thread_name_prefix='recipe-images')
+            if settings.IMAGE_WORKERS else None)
+
+
+def encode(image, image_format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def make_placeholder(image):
+    small = image.copy()
+    small.thumbnail(PLACEHOLDER_SIZE)
+    small = small.filter(ImageFilter.GaussianBlur(1))
+    content = base64.b64encode(encode(small, 'JPEG', quality=40)).decode()
+    return f'data:image/jpeg;base64,{content}'
+
+
+def make_variants(name):
+    with default_storage.open(name) as file:
+        image = Image.open(file).convert('RGBA')
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    image = background
+    stem = PurePosixPath(name).stem
+    variants = {'placeholder': make_placeholder(image)}
+    for size, width in THUMBNAIL_WIDTHS.items():
+        thumbnail = image.copy()
+        thumbnail.thumbnail((width, width * 4))
+        for extension, image_format in THUMBNAIL_FORMATS.items():
+            path = default_storage.save(
+                f'recipe_images/variants/{stem}_{size}.{extension}',
+                ContentFile(encode(thumbnail, image_format, quality=80)),
+            )
+            variants[f'{size}_{extension}'] = path
+    return variants
+
+
+def process_recipe_image(recipe_id):
+    """Создает миниатюры и размытую заглушку для картинки рецепта."""
+    name = Recipe.objects.filter(pk=recipe_id).values_list(
+        'image', flat=True).first()
+    if not name:
+        return
+    variants = make_variants(name)
+    Recipe.objects.filter(pk=recipe_id, image=name).update(
+        image_variants=variants, updated_at=timezone.now())
+
+
+def process_logged(recipe_id):
+    try:
+        process_recipe_image(recipe_id)
+    except Exception:
+        logger.exception('Не удалось обработать картинку рецепта %s',
+                         recipe_id)
+
+
+def run_in_worker(recipe_id):
+    try:
+        process_logged(recipe_id)
+    finally:
+        connection.close()
+
+
+def schedule_image_processing(recipe):
+    def submit():
+        if executor is None:
+            process_logged(recipe.pk)
+        else:
+            executor.submit(run_in_worker, recipe.pk)
+    transaction.on_commit(submit)
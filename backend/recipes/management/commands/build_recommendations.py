@@ -0,0 +1,48 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.models import Recipe, RecommendedRecipe, SimilarRecipe
+from recipes.recommendations import TOP_K, build_recommendations
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = ('Расчет похожих рецептов и рекомендаций пользователям '
+            'по избранному, корзинам и ингредиентам')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=TOP_K,
+                            help='Сколько соседей хранить на рецепт '
+                                 'и рекомендаций на пользователя')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        neighbors, recommendations = build_recommendations(options['top'])
+        with transaction.atomic():
+            recipe_ids = set(Recipe.objects.values_list('id', flat=True))
+            user_ids = set(User.objects.values_list('id', flat=True))
+            SimilarRecipe.objects.all().delete()
+            SimilarRecipe.objects.bulk_create((
+                SimilarRecipe(recipe_id=recipe_id, similar_id=other,
+                              score=score)
+                for recipe_id, items in neighbors.items()
+                if recipe_id in recipe_ids
+                for other, score in items if other in recipe_ids
+            ), batch_size=BATCH_SIZE)
+            RecommendedRecipe.objects.all().delete()
+            RecommendedRecipe.objects.bulk_create((
+                RecommendedRecipe(user_id=user_id, recipe_id=recipe_id,
+                                  score=score)
+                for user_id, items in recommendations.items()
+                if user_id in user_ids
+                for recipe_id, score in items if recipe_id in recipe_ids
+            ), batch_size=BATCH_SIZE)
+        self.stdout.write(
+            f'рецептов с похожими: {len(neighbors)}, '
+            f'пользователей с рекомендациями: {len(recommendations)}, '
+            f'за {time.monotonic() - started:.1f} с')
@@ -0,0 +1,64 @@
+import posixpath
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.db import models
+from django.utils import timezone
+from recipes.models import Recipe
+
+
+def walk(storage, path=''):
+    directories, files = storage.listdir(path)
+    for name in files:
+        yield posixpath.join(path, name)
+    for directory in directories:
+        yield from walk(storage, posixpath.join(path, directory))
+
+
+def get_referenced():
+    referenced = set()
+    for model in apps.get_models():
+        for field in model._meta.get_fields():
+            if isinstance(field, models.FileField):
+                referenced.update(
+                    model._default_manager.exclude(**{field.name: ''})
+                    .values_list(field.name, flat=True).iterator())
+    for variants in Recipe.objects.exclude(image_variants={}).values_list(
+            'image_variants', flat=True).iterator():
+        referenced.update(path for path in variants.values()
+                          if not path.startswith('data:'))
+    return referenced
+
+
+class Command(BaseCommand):
+    help = 'Удаление файлов из MEDIA_ROOT, на которые нет ссылок в базе'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только показать файлы для удаления')
+        parser.add_argument('--min-age', type=int, default=24 * 60 * 60,
+                            help='Не трогать файлы моложе заданного '
+                                 'количества секунд')
+
+    def handle(self, *args, **options):
+        if not default_storage.exists(''):
+            self.stdout.write('каталог медиафайлов не найден')
+            return
+        referenced = get_referenced()
+        threshold = timezone.now() - timedelta(seconds=options['min_age'])
+        count = size = 0
+        for path in walk(default_storage):
+            if path in referenced:
+                continue
+            if default_storage.get_modified_time(path) > threshold:
+                continue
+            count += 1
+            size += default_storage.size(path)
+            if options['dry_run']:
+                self.stdout.write(path)
+            else:
+                default_storage.delete(path)
+        action = 'найдено' if options['dry_run'] else 'удалено'
+        self.stdout.write(f'{action} {count} файлов, {size} байт')
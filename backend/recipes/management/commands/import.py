@@ -1,23 +1,94 @@
 import csv
+import json
+import time
+from pathlib import Path
 
-from django.core.management import BaseCommand
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
 from recipes.models import Ingredient
+from recipes.signals import ingredients_imported
+
+DEFAULT_PATH = Path(settings.BASE_DIR) / 'recipes' / 'ingredients.csv'
+READ_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n[,]':
+            position += 1
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            if eof:
+                if buffer[position:].strip():
+                    raise CommandError('Некорректный JSON-файл')
+                return
+            chunk = file.read(READ_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item['name'], item['measurement_unit']
+
+
+def read_ingredients(path):
+    reader = read_json if path.suffix == '.json' else read_csv
+    with open(path, encoding='utf-8') as file:
+        yield from reader(file)
 
 
 class Command(BaseCommand):
+    help = 'Загрузка ингредиентов из CSV или JSON файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default=DEFAULT_PATH,
+                            type=Path)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Прочитать файл без записи в базу')
+
     def handle(self, *args, **options):
-        file = open('./recipes/ingredients.csv', 'r', encoding='utf-8')
-        reader = csv.reader(file)
-        count_data = 0
-
-        for row in reader:
-            ingredient, data = Ingredient.objects.get_or_create(
-                name=row[0],
-                measurement_unit=row[1]
-            )
-            if data:
-                count_data += 1
-        if count_data > 0:
-            print(f'импортировано {count_data} ингредиентов')
+        path = options['path']
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        started = time.perf_counter()
+        count_before = Ingredient.objects.count()
+        seen = set()
+        batch = []
+        for name, unit in read_ingredients(path):
+            key = (name.strip(), unit.strip())
+            if not all(key) or key in seen:
+                continue
+            seen.add(key)
+            batch.append(Ingredient(name=key[0], measurement_unit=key[1]))
+            if len(batch) >= options['batch_size']:
+                self.save(batch, options['dry_run'])
+                batch = []
+        self.save(batch, options['dry_run'])
+        if not options['dry_run']:
+            ingredients_imported.send(sender=Ingredient)
+
+        count_data = Ingredient.objects.count() - count_before
+        elapsed = time.perf_counter() - started
+        if options['dry_run']:
+            self.stdout.write(f'прочитано {len(seen)} уникальных ингредиентов '
+                              f'за {elapsed:.2f} с')
+        elif count_data > 0:
+            self.stdout.write(f'импортировано {count_data} ингредиентов '
+                              f'за {elapsed:.2f} с')
         else:
-            print('объекты уже существуют')
+            self.stdout.write('объекты уже существуют')
+
+    def save(self, batch, dry_run):
+        if batch and not dry_run:
+            Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
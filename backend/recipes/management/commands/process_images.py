@@ -0,0 +1,26 @@
+from django.core.management import BaseCommand
+from recipes.images import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создание миниатюр для картинок рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='Пересоздать миниатюры для всех рецептов')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        count = failed = 0
+        for recipe_id in recipes.values_list('id', flat=True).iterator():
+            try:
+                process_recipe_image(recipe_id)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'рецепт {recipe_id}: {error}')
+                continue
+            count += 1
+        self.stdout.write(f'обработано {count} картинок, ошибок {failed}')
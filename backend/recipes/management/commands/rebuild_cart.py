@@ -0,0 +1,30 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.models import CartIngredient
+
+
+class Command(BaseCommand):
+    help = 'Пересборка итогов ингредиентов в корзинах пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, nargs='*', dest='users',
+                            help='id пользователей (по умолчанию все)')
+        parser.add_argument('--check', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        user_ids = options['users'] or None
+        with transaction.atomic():
+            broken = self.find_broken(user_ids)
+            if broken and not options['check']:
+                CartIngredient.objects.rebuild(broken)
+        self.stdout.write(f'корзин с расхождениями: {len(broken)}')
+
+    def find_broken(self, user_ids):
+        expected = CartIngredient.objects.expected_totals(user_ids)
+        stored = CartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount')
+        if user_ids is not None:
+            stored = stored.filter(user_id__in=user_ids)
+        difference = set(expected.iterator()) ^ set(stored.iterator())
+        return {user_id for user_id, _, _ in difference}
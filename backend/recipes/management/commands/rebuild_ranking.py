@@ -0,0 +1,13 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from recipes.ranking import rebuild_scores
+
+
+class Command(BaseCommand):
+    help = ('Пересчет оценок популярности рецептов по датам добавления '
+            'в избранное и корзину')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            updated = rebuild_scores()
+        self.stdout.write(f'рецептов с оценкой: {updated}')
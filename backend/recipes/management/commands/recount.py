@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from recipes.counters import COUNTERS, count_of
+
+
+class Command(BaseCommand):
+    help = 'Пересчет счетчиков избранного, корзин, рецептов и подписчиков'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true',
+                            help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, counter, source, field in COUNTERS:
+                actual = count_of(source, field)
+                broken = model.objects.annotate(actual=actual).exclude(
+                    **{counter: F('actual')}).count()
+                if broken and not options['check']:
+                    model.objects.update(**{counter: actual})
+                self.stdout.write(
+                    f'{model._meta.model_name}.{counter}: '
+                    f'расхождений {broken}')
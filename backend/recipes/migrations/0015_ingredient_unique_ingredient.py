@@ -0,0 +1,53 @@
+# Generated by Django 3.2 on 2026-10-18 18:02
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """Сливает повторы ингредиентов в запись с наименьшим id.
+
+    Рецепты переводятся на оставшуюся запись, а если в рецепте уже есть
+    и она, количества складываются, чтобы не нарушить уникальность
+    ингредиента в рецепте.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientRecipe = apps.get_model('recipes', 'IngredientRecipe')
+    duplicates = Ingredient.objects.values(
+        'name', 'measurement_unit'
+    ).annotate(
+        survivor_id=Min('id'), total=Count('id')
+    ).filter(total__gt=1).order_by()
+    for group in duplicates.iterator():
+        survivor_id = group['survivor_id']
+        duplicate_ids = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit'],
+        ).exclude(id=survivor_id).values_list('id', flat=True))
+        items = IngredientRecipe.objects.filter(
+            ingredient_id__in=duplicate_ids
+        ).order_by('id')
+        for item in items:
+            kept, created = IngredientRecipe.objects.get_or_create(
+                recipe_id=item.recipe_id, ingredient_id=survivor_id,
+                defaults={'amount': item.amount})
+            if not created:
+                kept.amount += item.amount
+                kept.save(update_fields=['amount'])
+            item.delete()
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_alter_recipe_cooking_time'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_ingredients,
+                             migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+from django.db import migrations
+
+# pg_trgm ставится командой CREATE EXTENSION: в PostgreSQL 13+ это
+# доверенное расширение и хватает права CREATE на базу, в более старых
+# версиях нужен суперпользователь. Если у пользователя приложения таких
+# прав нет, администратор заранее выполняет CREATE EXTENSION pg_trgm,
+# и миграция его пропускает.
+CREATE_INDEXES = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_prefix '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+]
+
+DROP_INDEXES = [
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+]
+
+
+def run_postgresql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0015_ingredient_unique_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgresql(CREATE_INDEXES),
+                             run_postgresql(DROP_INDEXES)),
+    ]
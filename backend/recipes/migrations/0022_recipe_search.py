@@ -0,0 +1,54 @@
+from django.db import migrations
+
+INGREDIENT_NAMES = (
+    "SELECT {aggregate} FROM recipes_ingredientrecipe ir "
+    "JOIN recipes_ingredient i ON i.id = ir.ingredient_id "
+    "WHERE ir.recipe_id = recipes_recipe.id"
+)
+
+CREATE = {
+    'postgresql': [
+        'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector',
+        'CREATE INDEX recipes_recipe_search ON recipes_recipe '
+        'USING gin (search_vector)',
+        "UPDATE recipes_recipe SET search_vector = "
+        "setweight(to_tsvector('russian', name), 'A') || "
+        "setweight(to_tsvector('russian', coalesce(({}), '')), 'B') || "
+        "setweight(to_tsvector('russian', text), 'C')".format(
+            INGREDIENT_NAMES.format(aggregate="string_agg(i.name, ' ')")),
+    ],
+    'sqlite': [
+        'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+        "name, ingredients, text, tokenize='unicode61 remove_diacritics 2')",
+        'INSERT INTO recipes_recipe_fts (rowid, name, ingredients, text) '
+        "SELECT id, name, coalesce(({}), ''), text "
+        'FROM recipes_recipe'.format(
+            INGREDIENT_NAMES.format(aggregate="group_concat(i.name, ' ')")),
+    ],
+}
+
+DROP = {
+    'postgresql': [
+        'DROP INDEX IF EXISTS recipes_recipe_search',
+        'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+    ],
+    'sqlite': ['DROP TABLE IF EXISTS recipes_recipe_fts'],
+}
+
+
+def run_for_vendor(statements):
+    def operation(apps, schema_editor):
+        for statement in statements.get(schema_editor.connection.vendor, []):
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0021_cart_ingredient'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_for_vendor(CREATE), run_for_vendor(DROP)),
+    ]
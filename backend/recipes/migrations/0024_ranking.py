@@ -0,0 +1,74 @@
+# Generated by Django 3.2 on 2026-10-18 18:34
+
+import math
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+import django.utils.timezone
+
+# Копия констант recipes/ranking.py: они должны совпадать, иначе оценки,
+# заполненные миграцией, разойдутся с вкладами событий, которые добавляет
+# и вычитает API. При изменении констант запустите rebuild_ranking.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HALF_LIVES = {
+    'popular_score': timedelta(days=180),
+    'trending_score': timedelta(days=7),
+}
+
+
+def fill_scores(apps, schema_editor):
+    # Все существующие события получают дату миграции, поэтому оценка
+    # пропорциональна числу добавлений в избранное и корзину.
+    Recipe = apps.get_model('recipes', 'Recipe')
+    age = (timezone.now() - EPOCH).total_seconds()
+    events = F('favorites_count') + F('cart_count') * 0.5
+    Recipe.objects.update(**{
+        field: events * math.exp(age * math.log(2)
+                                 / half_life.total_seconds())
+        for field, half_life in HALF_LIVES.items()
+    })
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0023_recommendations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='favorite',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='popular_score',
+            field=models.FloatField(default=0, verbose_name='Популярность'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='trending_score',
+            field=models.FloatField(default=0, verbose_name='Популярность за неделю'),
+        ),
+        migrations.AddField(
+            model_name='shoppingcart',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Дата добавления'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-popular_score', '-id'], name='recipe_popular_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-trending_score', '-id'], name='recipe_trending_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['cooking_time', '-id'], name='recipe_quickest_idx'),
+        ),
+        migrations.RunPython(fill_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+# Индексы строятся по тому же выражению, что и фильтр в
+# api.search.search_ingredients: верхний регистр и «ё», замененная на «е».
+CREATE_INDEXES = [
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+    "CREATE INDEX recipes_ingredient_name_prefix ON recipes_ingredient "
+    "(REPLACE(UPPER(name::text), 'Ё', 'Е') text_pattern_ops)",
+    "CREATE INDEX recipes_ingredient_name_trgm ON recipes_ingredient "
+    "USING gin (REPLACE(UPPER(name::text), 'Ё', 'Е') gin_trgm_ops)",
+]
+
+DROP_INDEXES = [
+    'DROP INDEX IF EXISTS recipes_ingredient_name_prefix',
+    'DROP INDEX IF EXISTS recipes_ingredient_name_trgm',
+    'CREATE INDEX recipes_ingredient_name_prefix '
+    'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+    'CREATE INDEX recipes_ingredient_name_trgm '
+    'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+]
+
+
+def run_postgresql(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'postgresql':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0024_ranking'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_postgresql(CREATE_INDEXES),
+                             run_postgresql(DROP_INDEXES)),
+    ]
@@ -1,7 +1,11 @@
 from django.contrib.auth import get_user_model
 from django.core.validators import MinValueValidator
 from django.db import models
-from django.db.models import UniqueConstraint
+from django.db.models import (Case, Exists, F, IntegerField, OuterRef,
+                              Prefetch, Sum, UniqueConstraint, Value, When)
+from django.db.models.functions import Greatest
+from django.utils import timezone
+from users.models import Subscribe
 
 User = get_user_model()
 
@@ -14,6 +18,10 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ['name']
+        constraints = [
+            UniqueConstraint(fields=['name', 'measurement_unit'],
+                             name='unique_ingredient')
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.measurement_unit}'
@@ -35,14 +43,55 @@ class Tag(models.Model):
         return self.name
 
 
+class RecipeQuerySet(models.QuerySet):
+
+    @staticmethod
+    def related_lookups():
+        return (
+            'tags',
+            Prefetch(
+                'ingredients_recipe',
+                queryset=IngredientRecipe.objects.select_related('ingredient')
+            ),
+        )
+
+    def with_related(self):
+        return self.select_related('author').prefetch_related(
+            *self.related_lookups())
+
+    def touch(self):
+        return self.update(updated_at=timezone.now())
+
+    def with_user_flags(self, user):
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=models.BooleanField()),
+                is_in_shopping_cart=Value(
+                    False, output_field=models.BooleanField()),
+                author_is_subscribed=Value(
+                    False, output_field=models.BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            author_is_subscribed=Exists(Subscribe.objects.filter(
+                user=user, author=OuterRef('author'))),
+        )
+
+
 class Recipe(models.Model):
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='recipes',
-        verbose_name='Автор',)
+        verbose_name='Автор',
+        db_index=False,)
     name = models.CharField('Название', max_length=150)
     image = models.ImageField('Картинка', upload_to='recipe_images')
+    image_variants = models.JSONField('Варианты картинки', default=dict,
+                                      blank=True)
     text = models.TextField('Текстовое описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -59,6 +108,13 @@ class Recipe(models.Model):
         'Время приготовления в минутах',
         validators=[MinValueValidator(1)]
     )
+    updated_at = models.DateTimeField('Дата изменения', auto_now=True)
+    favorites_count = models.PositiveIntegerField('В избранном', default=0)
+    cart_count = models.PositiveIntegerField('В корзинах', default=0)
+    popular_score = models.FloatField('Популярность', default=0)
+    trending_score = models.FloatField('Популярность за неделю', default=0)
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id']
@@ -68,6 +124,15 @@ class Recipe(models.Model):
             UniqueConstraint(fields=['author', 'name'],
                              name='unique_author_recipe')
         ]
+        indexes = [
+            models.Index(fields=['author', '-id'], name='recipe_author_idx'),
+            models.Index(fields=['-popular_score', '-id'],
+                         name='recipe_popular_idx'),
+            models.Index(fields=['-trending_score', '-id'],
+                         name='recipe_trending_idx'),
+            models.Index(fields=['cooking_time', '-id'],
+                         name='recipe_quickest_idx'),
+        ]
 
     def __str__(self):
         return f'{self.name}, {self.author}'
@@ -78,7 +143,8 @@ class IngredientRecipe(models.Model):
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
-        related_name='ingredients_recipe'
+        related_name='ingredients_recipe',
+        db_index=False,
     )
     ingredient = models.ForeignKey(
         Ingredient,
@@ -97,6 +163,10 @@ class IngredientRecipe(models.Model):
             UniqueConstraint(fields=['recipe', 'ingredient'],
                              name='unique_recipe_ingredient')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'ingredient', 'amount'],
+                         name='ingredientrecipe_amount_idx'),
+        ]
 
 
 class ShoppingCart(models.Model):
@@ -111,7 +181,9 @@ class ShoppingCart(models.Model):
         on_delete=models.CASCADE,
         related_name='cart',
         verbose_name='Рецепт',
+        db_index=False,
     )
+    created_at = models.DateTimeField('Дата добавления', default=timezone.now)
 
     class Meta:
         verbose_name = 'Корзина'
@@ -120,6 +192,10 @@ class ShoppingCart(models.Model):
             UniqueConstraint(fields=['user', 'recipe'],
                              name='unique_cart')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='cart_recipe_user_idx'),
+        ]
 
 
 class Favorite(models.Model):
@@ -134,7 +210,9 @@ class Favorite(models.Model):
         on_delete=models.CASCADE,
         related_name='favorites',
         verbose_name='Рецепт',
+        db_index=False,
     )
+    created_at = models.DateTimeField('Дата добавления', default=timezone.now)
 
     class Meta:
         verbose_name = 'Избранное'
@@ -143,3 +221,149 @@ class Favorite(models.Model):
             UniqueConstraint(fields=['user', 'recipe'],
                              name='unique_fav')
         ]
+        indexes = [
+            models.Index(fields=['recipe', 'user'],
+                         name='favorite_recipe_user_idx'),
+        ]
+
+
+class CartIngredientQuerySet(models.QuerySet):
+
+    def apply_deltas(self, user_ids, deltas):
+        """Прибавляет изменения количества ингредиентов к корзинам.
+
+        deltas: словарь ingredient_id -> изменение количества.
+        """
+        deltas = {key: value for key, value in deltas.items() if value}
+        user_ids = list(user_ids)
+        if not deltas or not user_ids:
+            return
+        self.bulk_create([
+            self.model(user_id=user_id, ingredient_id=ingredient_id,
+                       total_amount=0)
+            for user_id in user_ids
+            for ingredient_id, delta in deltas.items() if delta > 0
+        ], ignore_conflicts=True)
+        rows = self.filter(user_id__in=user_ids, ingredient_id__in=deltas)
+        rows.update(total_amount=Greatest(F('total_amount') + Case(
+            *[When(ingredient_id=ingredient_id, then=Value(delta))
+              for ingredient_id, delta in deltas.items()],
+            output_field=IntegerField(),
+        ), 0))
+        if any(delta < 0 for delta in deltas.values()):
+            rows.filter(total_amount=0).delete()
+
+    @staticmethod
+    def expected_totals(user_ids=None):
+        """Итоги корзин, посчитанные заново по рецептам в корзинах."""
+        # Условия на корзину задаются одним filter(): второй вызов добавил
+        # бы еще одно соединение с корзинами и умножил суммы.
+        conditions = {'recipe__cart__isnull': False}
+        if user_ids is not None:
+            conditions['recipe__cart__user_id__in'] = user_ids
+        items = IngredientRecipe.objects.filter(**conditions)
+        return items.values_list(
+            'recipe__cart__user_id', 'ingredient_id'
+        ).annotate(total=Sum('amount')).order_by()
+
+    def rebuild(self, user_ids=None):
+        """Пересобирает корзины заданных пользователей (или всех)."""
+        rows = self.all()
+        if user_ids is not None:
+            user_ids = list(user_ids)
+            rows = rows.filter(user_id__in=user_ids)
+        rows.delete()
+        totals = self.expected_totals(user_ids)
+        self.bulk_create((
+            self.model(user_id=user_id, ingredient_id=ingredient_id,
+                       total_amount=total)
+            for user_id, ingredient_id, total in totals.iterator()
+        ), batch_size=1000)
+
+
+class CartIngredient(models.Model):
+    """Сумма ингредиентов из всех рецептов в корзине пользователя."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Пользователь',
+        db_index=False,
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='cart_ingredients',
+        verbose_name='Ингредиент',
+    )
+    total_amount = models.PositiveIntegerField('Общее количество')
+
+    objects = CartIngredientQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Ингредиент в корзине'
+        verbose_name_plural = 'Ингредиенты в корзинах'
+        constraints = [
+            UniqueConstraint(fields=['user', 'ingredient'],
+                             name='unique_cart_ingredient')
+        ]
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт из списка, посчитанного build_recommendations."""
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_recipes',
+        verbose_name='Рецепт',
+        db_index=False,
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_for',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField('Сходство')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            UniqueConstraint(fields=['recipe', 'similar'],
+                             name='unique_similar_recipe')
+        ]
+        indexes = [
+            models.Index(fields=['recipe', '-score'],
+                         name='similar_recipe_score_idx'),
+        ]
+
+
+class RecommendedRecipe(models.Model):
+    """Рецепт, рекомендованный пользователю по избранному и корзине."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='recommendations',
+        verbose_name='Пользователь',
+        db_index=False,
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='recommended_for',
+        verbose_name='Рецепт',
+    )
+    score = models.FloatField('Оценка')
+
+    class Meta:
+        verbose_name = 'Рекомендация'
+        verbose_name_plural = 'Рекомендации'
+        constraints = [
+            UniqueConstraint(fields=['user', 'recipe'],
+                             name='unique_recommended_recipe')
+        ]
+        indexes = [
+            models.Index(fields=['user', '-score'],
+                         name='recommended_user_score_idx'),
+        ]
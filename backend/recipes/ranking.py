@@ -0,0 +1,65 @@
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# Вместо уменьшения всех оценок со временем каждое событие получает вес
+# exp((t - EPOCH) / tau): новые события весят больше старых ровно во столько
+# раз, во сколько старые успели бы «остыть», и порядок рецептов совпадает
+# с порядком по затухающей оценке. Поэтому оценку меняет один UPDATE при
+# добавлении в избранное или корзину, а при удалении вычитается вес события
+# с его исходной датой. Вес переполнит float примерно через 700 * tau
+# после EPOCH (для недельного полураспада ~19 лет).
+# EPOCH и HALF_LIVES повторены в миграции 0024_ranking и должны совпадать.
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+HALF_LIVES = {
+    'popular_score': timedelta(days=180),
+    'trending_score': timedelta(days=7),
+}
+EVENT_WEIGHTS = {
+    Favorite: 1.0,
+    ShoppingCart: 0.5,
+}
+BATCH_SIZE = 1000
+
+
+def score_terms(model):
+    """Вес события и скорость роста веса (1/с) для каждой оценки."""
+    return {
+        field: (EVENT_WEIGHTS[model],
+                math.log(2) / half_life.total_seconds())
+        for field, half_life in HALF_LIVES.items()
+    }
+
+
+def score_increments(model, timestamp=None):
+    """Вклад одного события в каждую из оценок рецепта."""
+    timestamp = timestamp or timezone.now()
+    age = (timestamp - EPOCH).total_seconds()
+    return {
+        field: weight * math.exp(age * rate)
+        for field, (weight, rate) in score_terms(model).items()
+    }
+
+
+def rebuild_scores():
+    """Пересчитывает оценки всех рецептов по датам событий.
+
+    Исправляет оценки после правок мимо API: через админку, ORM
+    или напрямую в базе.
+    """
+    scores = defaultdict(lambda: dict.fromkeys(HALF_LIVES, 0.0))
+    for model in EVENT_WEIGHTS:
+        rows = model.objects.values_list('recipe_id', 'created_at')
+        for recipe_id, created_at in rows.iterator(chunk_size=10000):
+            for field, value in score_increments(model, created_at).items():
+                scores[recipe_id][field] += value
+    Recipe.objects.update(**dict.fromkeys(HALF_LIVES, 0.0))
+    recipes = [Recipe(pk=recipe_id, **values)
+               for recipe_id, values in scores.items()]
+    Recipe.objects.bulk_update(recipes, list(HALF_LIVES),
+                               batch_size=BATCH_SIZE)
+    return len(recipes)
@@ -0,0 +1,136 @@
+import heapq
+import math
+from array import array
+from collections import Counter, defaultdict
+
+from .models import Favorite, IngredientRecipe, ShoppingCart
+
+TOP_K = 20
+CANDIDATES = 100
+FAVORITES_WEIGHT = 0.6
+INGREDIENTS_WEIGHT = 0.4
+# У пользователя с тысячами рецептов в избранном почти все пары рецептов
+# совпадают случайно, поэтому учитываются только его последние рецепты.
+MAX_USER_FAVORITES = 200
+# Ингредиенты вроде соли есть в большинстве рецептов: для подбора
+# кандидатов они бесполезны и дороги, но в точной близости учитываются.
+MAX_POSTING = 2000
+
+
+def user_items(model, limit=None):
+    items = defaultdict(list)
+    rows = model.objects.order_by('user_id', '-id').values_list(
+        'user_id', 'recipe_id')
+    for user_id, recipe_id in rows.iterator(chunk_size=10000):
+        if limit is None or len(items[user_id]) < limit:
+            items[user_id].append(recipe_id)
+    return items
+
+
+def favorite_similarity(favorites):
+    """Косинусная близость рецептов по совместному добавлению в избранное.
+
+    Возвращает словарь recipe_id -> Counter(соседний рецепт -> близость).
+    """
+    popularity = Counter()
+    pairs = defaultdict(Counter)
+    for recipes in favorites.values():
+        popularity.update(recipes)
+        for recipe_id in recipes:
+            pairs[recipe_id].update(recipes)
+    similarity = {}
+    for recipe_id, counts in pairs.items():
+        del counts[recipe_id]
+        similarity[recipe_id] = Counter({
+            other: count / math.sqrt(popularity[recipe_id]
+                                     * popularity[other])
+            for other, count in counts.items()
+        })
+    return similarity
+
+
+def ingredient_similarity(candidates=CANDIDATES):
+    """Косинусная близость наборов ингредиентов с весами IDF.
+
+    Кандидаты для каждого рецепта выбираются по числу общих ингредиентов
+    через инвертированный индекс, точная близость считается только для них.
+    """
+    postings = defaultdict(lambda: array('l'))
+    recipes = defaultdict(list)
+    rows = IngredientRecipe.objects.order_by('ingredient_id').values_list(
+        'ingredient_id', 'recipe_id')
+    for ingredient_id, recipe_id in rows.iterator(chunk_size=10000):
+        postings[ingredient_id].append(recipe_id)
+        recipes[recipe_id].append(ingredient_id)
+    total = len(recipes)
+    idf_squared = {ingredient_id: math.log(total / len(recipe_ids)) ** 2
+                   for ingredient_id, recipe_ids in postings.items()}
+    norms = {recipe_id: math.sqrt(sum(idf_squared[ingredient_id]
+                                      for ingredient_id in ingredients))
+             for recipe_id, ingredients in recipes.items()}
+    similarity = {}
+    for recipe_id, ingredients in recipes.items():
+        if not norms[recipe_id]:
+            continue
+        shared = Counter()
+        for ingredient_id in ingredients:
+            if len(postings[ingredient_id]) <= MAX_POSTING:
+                shared.update(postings[ingredient_id])
+        del shared[recipe_id]
+        own = set(ingredients)
+        scores = Counter()
+        for other, _ in shared.most_common(candidates):
+            if not norms[other]:
+                continue
+            dot = sum(idf_squared[ingredient_id]
+                      for ingredient_id in recipes[other]
+                      if ingredient_id in own)
+            scores[other] = dot / (norms[recipe_id] * norms[other])
+        similarity[recipe_id] = scores
+    return similarity
+
+
+def combine(favorites, ingredients, top=TOP_K):
+    """Взвешенная сумма двух близостей, top лучших соседей на рецепт."""
+    neighbors = {}
+    for recipe_id in favorites.keys() | ingredients.keys():
+        scores = Counter()
+        for other, score in favorites.get(recipe_id, {}).items():
+            scores[other] += FAVORITES_WEIGHT * score
+        for other, score in ingredients.get(recipe_id, {}).items():
+            scores[other] += INGREDIENTS_WEIGHT * score
+        best = heapq.nlargest(top, scores.items(), key=lambda item: item[1])
+        if best:
+            neighbors[recipe_id] = best
+    return neighbors
+
+
+def recommend(neighbors, profiles, top=TOP_K):
+    """Рекомендации пользователю: сумма близостей к его рецептам.
+
+    Рецепты, которые уже есть в избранном или корзине, пропускаются.
+    """
+    recommendations = {}
+    for user_id, recipes in profiles.items():
+        own = set(recipes)
+        scores = Counter()
+        for recipe_id in own:
+            for other, score in neighbors.get(recipe_id, ()):
+                if other not in own:
+                    scores[other] += score
+        best = heapq.nlargest(top, scores.items(), key=lambda item: item[1])
+        if best:
+            recommendations[user_id] = best
+    return recommendations
+
+
+def build_recommendations(top=TOP_K):
+    """Считает соседей рецептов и рекомендации пользователей в памяти."""
+    favorites = user_items(Favorite, MAX_USER_FAVORITES)
+    neighbors = combine(favorite_similarity(favorites),
+                        ingredient_similarity(), top)
+    profiles = defaultdict(list)
+    for items in (favorites, user_items(ShoppingCart, MAX_USER_FAVORITES)):
+        for user_id, recipes in items.items():
+            profiles[user_id].extend(recipes)
+    return neighbors, recommend(neighbors, profiles, top)
@@ -0,0 +1,135 @@
+import threading
+from collections import defaultdict
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import Signal, receiver
+from recipes.counters import COUNTERS, recount
+from recipes.models import Ingredient, Recipe, Tag
+
+User = get_user_model()
+
+# Связи, создаваемые через API, меняют счетчики тем же SQL-запросом
+# (api.utils.change_relation) и сигналов не вызывают. Здесь счетчики
+# пересчитываются для админки, каскадного удаления и прочих правок через ORM.
+COUNTED_FIELDS = {model: field for _, _, model, field in COUNTERS}
+
+# Поля автора, которые выводятся в рецепте: только их изменение
+# делает ответы с рецептами автора устаревшими.
+AUTHOR_FIELDS = frozenset({'email', 'username', 'first_name', 'last_name'})
+
+# bulk_create не вызывает post_save, поэтому команда импорта сообщает
+# о загрузке ингредиентов отдельным сигналом.
+ingredients_imported = Signal()
+# Админка меняет ингредиенты рецептов мимо API и сообщает об этом одним
+# сигналом на набор рецептов, а не на каждую строку IngredientRecipe.
+recipe_ingredients_changed = Signal()
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def touch_recipe_tags(sender, instance, action, reverse, pk_set, **kwargs):
+    if not reverse and action.startswith('post_'):
+        Recipe.objects.filter(pk=instance.pk).touch()
+    elif reverse and action in ('post_add', 'post_remove'):
+        Recipe.objects.filter(pk__in=pk_set).touch()
+    elif reverse and action == 'pre_clear':
+        Recipe.objects.filter(tags=instance).touch()
+
+
+@receiver(pre_delete, sender=Tag)
+def touch_deleted_tag_recipes(sender, instance, **kwargs):
+    Recipe.objects.filter(tags=instance).touch()
+
+
+@receiver(post_save, sender=Tag)
+def touch_tag_recipes(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(tags=instance).touch()
+
+
+@receiver(post_save, sender=Ingredient)
+def touch_ingredient_recipes(sender, instance, created, **kwargs):
+    if not created:
+        Recipe.objects.filter(ingredients=instance).touch()
+
+
+@receiver(pre_save, sender=User)
+def remember_author_fields(sender, instance, update_fields, **kwargs):
+    instance._author_fields = None
+    if instance.pk is not None and (update_fields is None
+                                    or AUTHOR_FIELDS & update_fields):
+        instance._author_fields = sender.objects.filter(
+            pk=instance.pk).values(*AUTHOR_FIELDS).first()
+
+
+@receiver(post_save, sender=User)
+def touch_author_recipes(sender, instance, created, **kwargs):
+    previous = getattr(instance, '_author_fields', None)
+    if created or previous is None:
+        return
+    if any(previous[field] != getattr(instance, field)
+           for field in AUTHOR_FIELDS):
+        Recipe.objects.filter(author=instance).touch()
+
+
+def remember_counted_target(sender, instance, update_fields, **kwargs):
+    field = COUNTED_FIELDS[sender]
+    instance._counted_target = None
+    if instance.pk is not None and (update_fields is None
+                                    or field in update_fields):
+        instance._counted_target = sender.objects.filter(
+            pk=instance.pk).values_list(f'{field}_id', flat=True).first()
+
+
+def recount_saved_target(sender, instance, created, **kwargs):
+    field = COUNTED_FIELDS[sender]
+    current = getattr(instance, f'{field}_id')
+    previous = getattr(instance, '_counted_target', None)
+    if created or (previous is not None and previous != current):
+        recount(sender, field, {current, previous} - {None})
+
+
+# При каскадном удалении рецепта или пользователя post_delete приходит на
+# каждую связанную строку. Затронутые объекты копятся до фиксации
+# транзакции и пересчитываются одним запросом на счетчик, а удаленные
+# вместе со связями пропускаются.
+pending_recounts = threading.local()
+
+
+def pending_state():
+    if not hasattr(pending_recounts, 'targets'):
+        pending_recounts.targets = defaultdict(set)
+        pending_recounts.deleted = defaultdict(set)
+    return pending_recounts
+
+
+def flush_recounts():
+    state = pending_state()
+    targets, deleted = state.targets, state.deleted
+    state.targets, state.deleted = defaultdict(set), defaultdict(set)
+    for source, target_ids in targets.items():
+        field = COUNTED_FIELDS[source]
+        target_ids -= deleted[source._meta.get_field(field).related_model]
+        if target_ids:
+            recount(source, field, target_ids)
+
+
+def recount_deleted_target(sender, instance, **kwargs):
+    field = COUNTED_FIELDS[sender]
+    pending_state().targets[sender].add(getattr(instance, f'{field}_id'))
+    transaction.on_commit(flush_recounts)
+
+
+def remember_deleted_target(sender, instance, **kwargs):
+    pending_state().deleted[sender].add(instance.pk)
+    transaction.on_commit(flush_recounts)
+
+
+for counted_model in COUNTED_FIELDS:
+    pre_save.connect(remember_counted_target, sender=counted_model)
+    post_save.connect(recount_saved_target, sender=counted_model)
+    post_delete.connect(recount_deleted_target, sender=counted_model)
+for target_model in {target for target, _, _, _ in COUNTERS}:
+    post_delete.connect(remember_deleted_target, sender=target_model)
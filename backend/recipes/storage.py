@@ -0,0 +1,36 @@
+import hashlib
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+
+class HashedFileSystemStorage(FileSystemStorage):
+    """Хранит файлы под именем, вычисленным из хеша содержимого.
+
+    Одинаковые картинки записываются на диск один раз, а сохраненный файл
+    никогда не перезаписывается, поэтому его можно кешировать навсегда.
+    """
+
+    def content_name(self, name, content):
+        sha256 = hashlib.sha256()
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        for chunk in content.chunks():
+            sha256.update(chunk)
+        if hasattr(content, 'seek'):
+            content.seek(0)
+        digest = sha256.hexdigest()
+        directory, filename = posixpath.split(name)
+        extension = posixpath.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
@@ -0,0 +1,105 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from .images import schedule_image_processing
+from .models import (CartIngredient, Ingredient, IngredientRecipe, Recipe,
+                     ShoppingCart)
+
+User = get_user_model()
+
+
+class CartIngredientRebuildTest(TestCase):
+
+    def setUp(self):
+        self.users = [
+            User.objects.create_user(
+                email=f'user{index}@example.com', username=f'user{index}',
+                password='password', first_name='Имя', last_name='Фамилия')
+            for index in range(2)
+        ]
+        self.flour = Ingredient.objects.create(name='мука',
+                                               measurement_unit='г')
+        self.sugar = Ingredient.objects.create(name='сахар',
+                                               measurement_unit='г')
+        self.recipe = Recipe.objects.create(
+            author=self.users[0], name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+        IngredientRecipe.objects.bulk_create([
+            IngredientRecipe(recipe=self.recipe, ingredient=self.flour,
+                             amount=420),
+            IngredientRecipe(recipe=self.recipe, ingredient=self.sugar,
+                             amount=100),
+        ])
+        for user in self.users:
+            ShoppingCart.objects.create(user=user, recipe=self.recipe)
+
+    def totals(self):
+        return set(CartIngredient.objects.values_list(
+            'user_id', 'ingredient_id', 'total_amount'))
+
+    def expected(self):
+        return {
+            (user.id, ingredient.id, amount)
+            for user in self.users
+            for ingredient, amount in ((self.flour, 420), (self.sugar, 100))
+        }
+
+    def test_rebuild_selected_users(self):
+        CartIngredient.objects.rebuild([user.id for user in self.users])
+        self.assertEqual(self.totals(), self.expected())
+
+    def test_rebuild_all_users(self):
+        CartIngredient.objects.rebuild()
+        self.assertEqual(self.totals(), self.expected())
+
+    def test_expected_totals_for_one_user(self):
+        totals = CartIngredient.objects.expected_totals([self.users[1].id])
+        self.assertEqual(set(totals), {
+            (self.users[1].id, self.flour.id, 420),
+            (self.users[1].id, self.sugar.id, 100),
+        })
+
+
+class ImageProcessingTest(TestCase):
+
+    def test_inline_failure_is_logged(self):
+        author = User.objects.create_user(
+            email='author@example.com', username='author',
+            password='password', first_name='Имя', last_name='Фамилия')
+        recipe = Recipe.objects.create(
+            author=author, name='Пирог', text='Испечь',
+            image='recipe_images/missing.png', cooking_time=40)
+        with mock.patch('recipes.images.executor', None), \
+                self.assertLogs('recipes.images', 'ERROR'), \
+                self.captureOnCommitCallbacks(execute=True):
+            schedule_image_processing(recipe)
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_variants, {})
+
+
+class AuthorRecipesTouchTest(TestCase):
+
+    def setUp(self):
+        self.author = User.objects.create_user(
+            email='author@example.com', username='author',
+            password='password', first_name='Имя', last_name='Фамилия')
+        self.recipe = Recipe.objects.create(
+            author=self.author, name='Пирог', text='Испечь',
+            image='recipe_images/pie.png', cooking_time=40)
+        self.updated_at = self.recipe.updated_at
+
+    def touched(self):
+        self.recipe.refresh_from_db()
+        return self.recipe.updated_at != self.updated_at
+
+    def test_unrelated_save_keeps_recipes(self):
+        self.author.set_password('another-password')
+        self.author.save()
+        self.assertFalse(self.touched())
+
+    def test_name_change_touches_recipes(self):
+        self.author.first_name = 'Другое'
+        self.author.save()
+        self.assertTrue(self.touched())
@@ -12,8 +12,11 @@ class UserAdmin(UserAdmin):
         'email',
         'first_name',
         'last_name',
+        'recipes_count',
+        'subscribers_count',
     )
     list_filter = ('email', 'first_name')
+    readonly_fields = ('recipes_count', 'subscribers_count')
 
 
 @admin.register(Subscribe)
@@ -13,6 +13,10 @@ class User(AbstractUser):
     password = models.CharField('Пароль', max_length=100)
     first_name = models.CharField('Имя', max_length=100)
     last_name = models.CharField('Фамилия', max_length=100)
+    recipes_count = models.PositiveIntegerField('Количество рецептов',
+                                                default=0)
+    subscribers_count = models.PositiveIntegerField('Количество подписчиков',
+                                                    default=0)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = [
@@ -42,6 +46,7 @@ class Subscribe(models.Model):
         on_delete=models.CASCADE,
         related_name='subscribing',
         verbose_name='Автор',
+        db_index=False,
     )
 
     class Meta:
@@ -50,5 +55,9 @@ class Subscribe(models.Model):
             UniqueConstraint(fields=['user', 'author'],
                              name='unique_sub')
         ]
+        indexes = [
+            models.Index(fields=['author', 'user'],
+                         name='subscribe_author_user_idx'),
+        ]
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'